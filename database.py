@@ -1,30 +1,132 @@
 import os
+from contextlib import contextmanager
 import mysql.connector
 from mysql.connector import Error, pooling
 from dotenv import load_dotenv
 import numpy as np
 from typing import Optional, List, Tuple
 from datetime import datetime
+from logger_config import logger
 
 load_dotenv()
 
+# Filas por lote al leer embeddings con fetchmany (limita la memoria viva durante la carga)
+FETCH_BATCH_SIZE = 512
+
+# Filas por sentencia executemany en inserciones masivas
+BULK_INSERT_CHUNK_SIZE = 1000
+
+# Filas por transacción al reescribir embeddings existentes (migrate_normalize)
+MIGRATION_COMMIT_EVERY = 1000
+
+# Filas por lote al leer IDs de usuario
+USER_IDS_BATCH_SIZE = 1024
+
+# Columna FK hacia la tabla de usuarios (algunos esquemas usan 'usuario_id')
+USER_FK_COL = os.getenv('USERS_FK_COLUMN', 'id_usuario')
+
+# Formato de almacenamiento de nuevos embeddings: 'float32' (por defecto) o 'int8' (cuantizado, ~4x menos bytes)
+EMBEDDING_STORAGE_FORMAT = os.getenv('EMBEDDING_STORAGE_FORMAT', 'float32').lower()
+
+# Embeddings cuantizados: magic + versión (4 bytes), escala float32 (4 bytes) y D valores int8
+QUANTIZED_EMBEDDING_MAGIC = b'QI8\x01'
+QUANTIZED_HEADER_SIZE = len(QUANTIZED_EMBEDDING_MAGIC) + 4
+
+
+def _is_quantized(embedding_bytes) -> bool:
+    # Detectar si el BLOB usa el formato int8 (los float32 heredados no llevan cabecera)
+    return (
+        len(embedding_bytes) > QUANTIZED_HEADER_SIZE
+        and bytes(embedding_bytes[:len(QUANTIZED_EMBEDDING_MAGIC)]) == QUANTIZED_EMBEDDING_MAGIC
+    )
+
+
+def _embedding_dim(embedding_bytes) -> int:
+    # Dimensión del embedding almacenado en el BLOB, o -1 si el tamaño no es válido
+    if _is_quantized(embedding_bytes):
+        return len(embedding_bytes) - QUANTIZED_HEADER_SIZE
+    if len(embedding_bytes) % 4 != 0:
+        return -1
+    return len(embedding_bytes) // 4
+
+
+def _encode_embedding(embedding: np.ndarray) -> bytes:
+    # Serializar un embedding al formato de almacenamiento configurado
+    # Siempre se guarda con norma L2 unitaria: la similitud coseno posterior es un simple producto punto
+    vector = np.ascontiguousarray(embedding, dtype=np.float32).ravel()
+    vector = vector / (np.linalg.norm(vector) + 1e-12)
+    if EMBEDDING_STORAGE_FORMAT != 'int8':
+        return vector.tobytes()
+    
+    # Cuantización simétrica por vector: x ≈ q * scale, con q en [-127, 127]
+    max_abs = float(np.abs(vector).max()) if vector.size else 0.0
+    scale = np.float32(max_abs / 127 if max_abs > 0 else 1.0)
+    quantized = np.round(vector / scale).astype(np.int8)
+    return QUANTIZED_EMBEDDING_MAGIC + scale.tobytes() + quantized.tobytes()
+
+
+def _decode_embedding_into(embedding_bytes, out: np.ndarray):
+    # Deserializar un BLOB (float32 o int8) directamente sobre un array float32 existente
+    if _is_quantized(embedding_bytes):
+        scale = np.frombuffer(embedding_bytes, dtype=np.float32, count=1, offset=len(QUANTIZED_EMBEDDING_MAGIC))[0]
+        np.multiply(np.frombuffer(embedding_bytes, dtype=np.int8, offset=QUANTIZED_HEADER_SIZE), scale, out=out)
+    else:
+        # Copia directa de los bytes (un solo memcpy, sin ndarray intermedio)
+        out.view(np.uint8)[:] = memoryview(embedding_bytes)
+
+
+def _decode_embedding(embedding_bytes) -> np.ndarray:
+    # Deserializar un BLOB a un embedding float32 (vista sin copia para el formato float32)
+    if _is_quantized(embedding_bytes):
+        out = np.empty(_embedding_dim(embedding_bytes), dtype=np.float32)
+        _decode_embedding_into(embedding_bytes, out)
+        return out
+    return np.frombuffer(embedding_bytes, dtype=np.float32)
+
 class Database:
     _connection_pool = None
     
+    # Consultas construidas una sola vez al definir la clase
+    _INSERT_EMBEDDING_QUERY = f"""
+        INSERT INTO usuarios_face_embeddings ({USER_FK_COL}, embedding, estado)
+        VALUES (%s, %s, %s)
+    """
+    _SELECT_BY_USER_QUERY = f"""
+        SELECT id_usuario_face_embedding, embedding, creado_en, estado
+        FROM usuarios_face_embeddings
+        WHERE {USER_FK_COL} = %s
+    """
+    _COUNT_ALL_QUERY = "SELECT COUNT(*) FROM usuarios_face_embeddings"
+    _EMBEDDINGS_STATE_QUERY = "SELECT COUNT(*), SUM(estado), MAX(creado_en) FROM usuarios_face_embeddings"
+    _SELECT_ALL_BLOBS_QUERY = "SELECT id_usuario_face_embedding, embedding FROM usuarios_face_embeddings"
+    _UPDATE_EMBEDDING_QUERY = "UPDATE usuarios_face_embeddings SET embedding = %s WHERE id_usuario_face_embedding = %s"
+    _SELECT_ALL_QUERY = f"""
+        SELECT id_usuario_face_embedding, {USER_FK_COL}, embedding, creado_en, estado
+        FROM usuarios_face_embeddings
+    """
+    _USER_HAS_EMBEDDINGS_QUERY = f"SELECT EXISTS(SELECT 1 FROM usuarios_face_embeddings WHERE {USER_FK_COL} = %s LIMIT 1)"
+    _DISTINCT_USER_IDS_QUERY = f"SELECT DISTINCT {USER_FK_COL} FROM usuarios_face_embeddings"
+    _COUNT_DISTINCT_USER_IDS_QUERY = f"SELECT COUNT(DISTINCT {USER_FK_COL}) FROM usuarios_face_embeddings"
+    
     @classmethod
     def _get_pool(cls):
         # Create and return MySQL connection pool
         if cls._connection_pool is None:
             try:
+                # Tamaño del pool configurable (máximo permitido por mysql-connector: 32)
+                pool_size = min(int(os.getenv('DATABASE_POOL_SIZE', 20)), pooling.CNX_POOL_MAXSIZE)
                 cls._connection_pool = pooling.MySQLConnectionPool(
-                    pool_name="face_recognition_pool",
-                    pool_size=5,
-                    pool_reset_session=True,
+                    # Nombre con PID para que los workers (fork) no compartan el mismo pool
+                    pool_name=f"face_recognition_pool_{os.getpid()}",
+                    pool_size=pool_size,
+                    pool_reset_session=os.getenv('DATABASE_POOL_RESET_SESSION', 'true').lower() == 'true',
                     host=os.getenv('DATABASE_HOST'),
                     port=int(os.getenv('DATABASE_PORT', 3306)),
                     user=os.getenv('DATABASE_USER'),
                     password=os.getenv('DATABASE_PASSWORD'),
                     database=os.getenv('DATABASE_SCHEMA'),
+                    connection_timeout=int(os.getenv('DATABASE_CONNECTION_TIMEOUT', 10)),
+                    use_pure=False,  # Usar la extensión C cuando esté disponible
                     autocommit=False
                 )
             except Error as e:
@@ -41,6 +143,32 @@ class Database:
         except Error as e:
             raise ConnectionError(f"Failed to get connection from pool: {e}")
     
+    @classmethod
+    @contextmanager
+    def _cursor(cls, commit: bool = False, **cursor_options):
+        # Yield (conn, cursor) from the pool; commit on success if requested, rollback on error,
+        # and always return the connection to the pool (the pool already tracks liveness)
+        conn = cls.get_connection()
+        cursor = None
+        try:
+            cursor = conn.cursor(**cursor_options)
+            yield conn, cursor
+            if commit:
+                conn.commit()
+        except BaseException:
+            try:
+                conn.rollback()
+            except Error:
+                pass
+            raise
+        finally:
+            if cursor is not None:
+                try:
+                    cursor.close()
+                except Error:
+                    pass
+            conn.close()
+    
     @classmethod
     def test_connection(cls) -> bool:
         # Test database connection availability
@@ -51,173 +179,262 @@ class Database:
                 return True
             return False
         except Exception as e:
-            print(f"Connection test failed: {e}")
+            logger.warning(f"Prueba de conexión fallida: {e}")
             return False
     
+    @classmethod
+    def _raise_insert_error(cls, e: Error, user_id: int, context: str):
+        # Translate a MySQL insert error into the application's exceptions
+        error_msg = str(e)
+        # Detectar errores específicos de MySQL
+        error_code = e.errno if hasattr(e, 'errno') else None
+        
+        # Error 1452: Cannot add or update a child row: foreign key constraint fails
+        # El usuario no existe en la tabla usuarios
+        if error_code == 1452 or "foreign key constraint" in error_msg.lower():
+            from exceptions import UserNotFoundError
+            raise UserNotFoundError(
+                str(user_id),
+                f"El usuario {user_id} no existe en la tabla 'usuarios'. Debe existir antes de registrar embeddings."
+            )
+        
+        # Otros errores de BD
+        logger.opt(exception=e).bind(user_id=user_id).error(f"Error insertando {context}")
+        from exceptions import DatabaseError
+        raise DatabaseError(f"Error al insertar {context}: {error_msg}")
+    
     @classmethod
     def insert_embedding(cls, user_id: int, embedding: np.ndarray) -> Optional[int]:
         # Insert face embedding into database for a user
-        conn = None
         try:
-            conn = cls.get_connection()
-            cursor = conn.cursor()
-            
-            embedding_float32 = embedding.astype(np.float32)
-            embedding_bytes = embedding_float32.tobytes()
-            
-            query = """
-                INSERT INTO usuarios_face_embeddings (id_usuario, embedding, estado)
-                VALUES (%s, %s, %s)
-            """
-            
-            cursor.execute(query, (user_id, embedding_bytes, 1))
-            conn.commit()
-            
-            embedding_id = cursor.lastrowid
+            with cls._cursor(commit=True) as (conn, cursor):
+                embedding_bytes = _encode_embedding(embedding)
+                cursor.execute(cls._INSERT_EMBEDDING_QUERY, (user_id, embedding_bytes, 1))
+                embedding_id = cursor.lastrowid
             return embedding_id
-            
         except Error as e:
-            if conn:
-                conn.rollback()
-            error_msg = str(e)
-            # Detectar errores específicos de MySQL
-            error_code = e.errno if hasattr(e, 'errno') else None
-            
-            # Error 1452: Cannot add or update a child row: foreign key constraint fails
-            # El usuario no existe en la tabla usuarios
-            if error_code == 1452 or "foreign key constraint" in error_msg.lower():
-                from exceptions import UserNotFoundError
-                raise UserNotFoundError(
-                    str(user_id),
-                    f"El usuario {user_id} no existe en la tabla 'usuarios'. Debe existir antes de registrar embeddings."
-                )
+            cls._raise_insert_error(e, user_id, "embedding")
+    
+    @classmethod
+    def insert_embeddings_bulk(cls, user_id: int, embeddings: np.ndarray) -> int:
+        # Insert several face embeddings for a user in one transaction (executemany + single commit)
+        embeddings_float32 = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if embeddings_float32.ndim == 1:
+            embeddings_float32 = embeddings_float32.reshape(1, -1)
+        
+        try:
+            inserted = 0
+            with cls._cursor(commit=True) as (conn, cursor):
+                for start in range(0, len(embeddings_float32), BULK_INSERT_CHUNK_SIZE):
+                    chunk = embeddings_float32[start:start + BULK_INSERT_CHUNK_SIZE]
+                    data = [(user_id, _encode_embedding(row), 1) for row in chunk]
+                    cursor.executemany(cls._INSERT_EMBEDDING_QUERY, data)
+                    inserted += len(data)
+            return inserted
+        except Error as e:
+            cls._raise_insert_error(e, user_id, "embeddings")
+    
+    @classmethod
+    def migrate_normalize(cls) -> int:
+        # One-time migration: rewrite stored embeddings as unit-norm vectors in the configured format
+        updated = 0
+        try:
+            # Lectura en streaming por una conexión y escritura por otra (un cursor sin buffer
+            # no admite otras sentencias en la misma conexión hasta consumir el resultado)
+            with cls._cursor(buffered=False) as (_, read_cursor), \
+                    cls._cursor(commit=True) as (write_conn, write_cursor):
+                read_cursor.arraysize = FETCH_BATCH_SIZE
+                read_cursor.execute(cls._SELECT_ALL_BLOBS_QUERY)
+                
+                pending = 0
+                while True:
+                    rows = read_cursor.fetchmany(read_cursor.arraysize)
+                    if not rows:
+                        break
+                    
+                    for embedding_id, embedding_bytes in rows:
+                        if not embedding_bytes or _embedding_dim(embedding_bytes) <= 0:
+                            continue
+                        
+                        embedding = _decode_embedding(embedding_bytes)
+                        already_normalized = abs(float(np.linalg.norm(embedding)) - 1.0) < 1e-4
+                        same_format = _is_quantized(embedding_bytes) == (EMBEDDING_STORAGE_FORMAT == 'int8')
+                        if already_normalized and same_format:
+                            continue
+                        
+                        write_cursor.execute(cls._UPDATE_EMBEDDING_QUERY, (_encode_embedding(embedding), embedding_id))
+                        updated += 1
+                        pending += 1
+                        
+                        if pending >= MIGRATION_COMMIT_EVERY:
+                            write_conn.commit()
+                            pending = 0
             
-            # Otros errores de BD
-            print(f"Error inserting embedding: {e}")
+            if updated:
+                # Los BLOB se reescriben en el sitio (sin cambiar la huella de la tabla): el snapshot ya no vale
+                from embeddings_cache import invalidate_embeddings_snapshot
+                invalidate_embeddings_snapshot()
+            return updated
+        except Error as e:
+            logger.exception("Error normalizando embeddings")
             from exceptions import DatabaseError
-            raise DatabaseError(f"Error al insertar embedding: {error_msg}")
-        finally:
-            if conn and conn.is_connected():
-                cursor.close()
-                conn.close()
+            raise DatabaseError(f"Error al normalizar embeddings: {str(e)}")
     
     @classmethod
     def get_embeddings_by_user(cls, user_id: int) -> List[Tuple[int, np.ndarray, datetime, bool]]:
         # Retrieve all embeddings for a specific user from database
-        conn = None
         results = []
         try:
-            conn = cls.get_connection()
-            cursor = conn.cursor()
-            
-            query = """
-                SELECT id_usuario_face_embedding, embedding, creado_en, estado
-                FROM usuarios_face_embeddings
-                WHERE id_usuario = %s
-            """
-            
-            cursor.execute(query, (user_id,))
-            rows = cursor.fetchall()
+            with cls._cursor() as (_, cursor):
+                cursor.execute(cls._SELECT_BY_USER_QUERY, (user_id,))
+                rows = cursor.fetchall()
             
             for row in rows:
                 embedding_id, embedding_bytes, creado_en, estado = row
-                embedding = np.frombuffer(embedding_bytes, dtype=np.float32)
+                embedding = _decode_embedding(embedding_bytes)
                 results.append((embedding_id, embedding, creado_en, bool(estado)))
             
             return results
             
         except Error as e:
-            print(f"Error fetching embeddings: {e}")
+            logger.bind(user_id=user_id).exception("Error obteniendo embeddings")
             return []
-        finally:
-            if conn and conn.is_connected():
-                cursor.close()
-                conn.close()
     
     @classmethod
-    def get_all_embeddings(cls) -> List[Tuple[int, int, np.ndarray, datetime, bool]]:
-        # Retrieve all embeddings from database for face comparison
-        conn = None
-        results = []
+    def get_all_embeddings_matrix(cls) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[datetime], np.ndarray]:
+        # Retrieve all embeddings as one contiguous (N, D) float32 matrix plus parallel column arrays
+        empty = (
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.int64),
+            np.empty((0, 0), dtype=np.float32),
+            [],
+            np.empty(0, dtype=bool)
+        )
         try:
-            conn = cls.get_connection()
-            cursor = conn.cursor()
-            
-            query = """
-                SELECT id_usuario_face_embedding, id_usuario, embedding, creado_en, estado
-                FROM usuarios_face_embeddings
-            """
+            # Cursor sin buffer: las filas se reciben por lotes mientras se copian a la matriz
+            with cls._cursor(buffered=False) as (_, cursor):
+                cursor.arraysize = FETCH_BATCH_SIZE
+                
+                cursor.execute(cls._COUNT_ALL_QUERY)
+                total = cursor.fetchall()[0][0]
+                if total == 0:
+                    return empty
+                
+                cursor.execute(cls._SELECT_ALL_QUERY)
+                
+                ids = np.empty(total, dtype=np.int64)
+                user_ids = np.empty(total, dtype=np.int64)
+                estados = np.empty(total, dtype=bool)
+                created_at = []
+                matrix = None
+                dim = 0
+                count = 0
+                
+                while True:
+                    rows = cursor.fetchmany(cursor.arraysize)
+                    if not rows:
+                        break
+                    
+                    for embedding_id, id_usuario, embedding_bytes, creado_en, estado in rows:
+                        # Filas insertadas entre el COUNT y el SELECT se ignoran (se verán en la próxima carga)
+                        if count >= total:
+                            continue
+                        if not embedding_bytes:
+                            logger.bind(user_id=id_usuario, embedding_id=embedding_id).warning("Embedding vacío")
+                            continue
+                        row_dim = _embedding_dim(embedding_bytes)
+                        if matrix is None and row_dim > 0:
+                            # La dimensión se infiere del primer embedding válido
+                            dim = row_dim
+                            matrix = np.empty((total, dim), dtype=np.float32)
+                        if row_dim != dim or matrix is None:
+                            logger.bind(user_id=id_usuario, embedding_id=embedding_id).error("Embedding con dimensión inválida")
+                            continue
+                        
+                        # Deserializar directamente sobre la fila de la matriz (float32 o int8 decuantizado)
+                        _decode_embedding_into(embedding_bytes, matrix[count])
+                        ids[count] = embedding_id
+                        user_ids[count] = id_usuario
+                        estados[count] = bool(estado)
+                        created_at.append(creado_en)
+                        count += 1
             
-            cursor.execute(query)
-            rows = cursor.fetchall()
+            if matrix is None:
+                return empty
             
-            for row in rows:
-                embedding_id, id_usuario, embedding_bytes, creado_en, estado = row
-                try:
-                    # Convertir bytes a array NumPy
-                    embedding = np.frombuffer(embedding_bytes, dtype=np.float32).copy()
-                    # Asegurar que es un array 1D
-                    embedding = embedding.flatten()
-                    # Validar que no esté vacío
-                    if embedding.size == 0:
-                        print(f"[WARNING] Embedding vacío para usuario {id_usuario} (ID: {embedding_id})")
-                        continue
-                    results.append((embedding_id, id_usuario, embedding, creado_en, bool(estado)))
-                except Exception as e:
-                    print(f"[ERROR] Error al procesar embedding para usuario {id_usuario} (ID: {embedding_id}): {e}")
-                    continue
+            return ids[:count], user_ids[:count], matrix[:count], created_at, estados[:count]
             
-            return results
+        except Error as e:
+            logger.exception("Error obteniendo la matriz de embeddings")
+            return empty
+    
+    @classmethod
+    def get_all_embeddings(cls) -> List[Tuple[int, int, np.ndarray, datetime, bool]]:
+        # Retrieve all embeddings from database for face comparison (list-of-tuples view of the matrix)
+        ids, user_ids, matrix, created_at, estados = cls.get_all_embeddings_matrix()
+        # Cada embedding es una vista (sin copia) de una fila de la matriz; se marca de solo lectura
+        # para que ningún consumidor modifique la matriz compartida
+        matrix.setflags(write=False)
+        return [
+            (int(ids[i]), int(user_ids[i]), matrix[i], created_at[i], bool(estados[i]))
+            for i in range(len(ids))
+        ]
+    
+    @classmethod
+    def get_embeddings_state(cls) -> Optional[Tuple[int, int, Optional[datetime]]]:
+        # Cheap fingerprint of the table (total rows, active rows, latest creation) to validate cache snapshots
+        try:
+            with cls._cursor() as (_, cursor):
+                cursor.execute(cls._EMBEDDINGS_STATE_QUERY)
+                total, activos, ultimo = cursor.fetchall()[0]
+                return int(total), int(activos or 0), ultimo
             
         except Error as e:
-            print(f"Error fetching all embeddings: {e}")
-            return []
-        finally:
-            if conn and conn.is_connected():
-                cursor.close()
-                conn.close()
+            logger.exception("Error obteniendo el estado de la tabla de embeddings")
+            return None
     
     @classmethod
     def user_has_embeddings(cls, user_id: int) -> bool:
         # Check if user already has embeddings registered in database
-        conn = None
         try:
-            conn = cls.get_connection()
-            cursor = conn.cursor()
-            
-            query = "SELECT COUNT(*) FROM usuarios_face_embeddings WHERE id_usuario = %s"
-            cursor.execute(query, (user_id,))
-            count = cursor.fetchone()[0]
-            
-            return count > 0
+            with cls._cursor() as (_, cursor):
+                # EXISTS se detiene en la primera entrada del índice y siempre devuelve una sola fila (0 o 1)
+                cursor.execute(cls._USER_HAS_EMBEDDINGS_QUERY, (user_id,))
+                return bool(cursor.fetchone()[0])
             
         except Error as e:
-            print(f"Error checking user embeddings: {e}")
+            logger.bind(user_id=user_id).exception("Error verificando embeddings del usuario")
             return False
-        finally:
-            if conn and conn.is_connected():
-                cursor.close()
-                conn.close()
     
     @classmethod
     def get_all_user_ids(cls) -> set:
         # Get all user IDs that have embeddings in database
-        conn = None
         try:
-            conn = cls.get_connection()
-            cursor = conn.cursor()
-            
-            query = "SELECT DISTINCT id_usuario FROM usuarios_face_embeddings"
-            cursor.execute(query)
-            rows = cursor.fetchall()
+            with cls._cursor(buffered=False) as (_, cursor):
+                cursor.arraysize = USER_IDS_BATCH_SIZE
+                cursor.execute(cls._DISTINCT_USER_IDS_QUERY)
+                
+                user_ids = set()
+                while True:
+                    rows = cursor.fetchmany(cursor.arraysize)
+                    if not rows:
+                        break
+                    user_ids.update(row[0] for row in rows)
             
-            return {row[0] for row in rows}
+            return user_ids
             
         except Error as e:
-            print(f"Error fetching user IDs: {e}")
+            logger.exception("Error obteniendo IDs de usuario")
             return set()
-        finally:
-            if conn and conn.is_connected():
-                cursor.close()
-                conn.close()
-
+    
+    @classmethod
+    def count_user_ids(cls) -> int:
+        # Count distinct users with embeddings without transferring the IDs
+        try:
+            with cls._cursor() as (_, cursor):
+                cursor.execute(cls._COUNT_DISTINCT_USER_IDS_QUERY)
+                return cursor.fetchall()[0][0]
+            
+        except Error as e:
+            logger.exception("Error contando IDs de usuario")
+            return 0
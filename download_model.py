@@ -2,10 +2,179 @@
 Script para descargar manualmente el modelo de DeepFace
 """
 import os
+import hashlib
 import urllib.request
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import sys
 
+# Número de conexiones simultáneas para la descarga por rangos
+DOWNLOAD_WORKERS = 8
+
+# Tamaño de bloque de lectura/escritura (1 MB)
+CHUNK_SIZE = 1 << 20
+
+# SHA-256 esperado del modelo (opcional); si está vacío solo se verifica el tamaño y se muestra el hash
+MODEL_SHA256 = os.getenv("VGG_FACE_SHA256", "").lower()
+
+# Intentos completos si la verificación de integridad falla
+MAX_ATTEMPTS = 2
+
+
+class RangeNotSupportedError(Exception):
+    """El servidor no respondió 206 a una petición con cabecera Range"""
+
+
+class IntegrityError(Exception):
+    """El archivo descargado no coincide con el tamaño o el hash esperado"""
+
+
+def _get_remote_info(url):
+    """
+    Obtiene la URL final (tras redirecciones), el tamaño, si el servidor acepta rangos y el ETag
+    """
+    request = urllib.request.Request(url, method="HEAD")
+    with urllib.request.urlopen(request, timeout=30) as response:
+        final_url = response.geturl()
+        total_size = int(response.headers.get("Content-Length", 0))
+        accepts_ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+        etag = response.headers.get("ETag", "")
+    return final_url, total_size, accepts_ranges, etag
+
+
+def _print_progress(downloaded, total_size):
+    """Muestra el progreso de la descarga en la misma línea"""
+    percent = min(downloaded * 100 / total_size, 100) if total_size else 0
+    downloaded_mb = downloaded / (1024 * 1024)
+    total_mb = total_size / (1024 * 1024)
+    sys.stdout.write(f"\r[Descargando] {percent:.1f}% - {downloaded_mb:.1f} MB / {total_mb:.1f} MB")
+    sys.stdout.flush()
+
+
+def _part_size(path):
+    """Tamaño de un archivo parcial (0 si no existe)"""
+    return path.stat().st_size if path.exists() else 0
+
+
+def _fetch_into(url, part_file, start, end, on_chunk):
+    """
+    Descarga los bytes [start + ya descargados, end] y los añade al final de part_file.
+    Si el archivo parcial ya cubre el rango completo no se hace ninguna petición.
+    """
+    offset = start + _part_size(part_file)
+    if end is not None and offset > end:
+        return
+    
+    headers = {}
+    if offset > 0:
+        headers["Range"] = f"bytes={offset}-" + (str(end) if end is not None else "")
+    elif end is not None:
+        headers["Range"] = f"bytes=0-{end}"
+    
+    request = urllib.request.Request(url, headers=headers)
+    with urllib.request.urlopen(request, timeout=60) as response:
+        if headers and response.status != 206:
+            raise RangeNotSupportedError(f"Respuesta HTTP {response.status} a una petición por rango")
+        # 'ab' conserva lo descargado en intentos anteriores
+        with open(part_file, "ab") as f:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                on_chunk(len(chunk))
+
+
+def _download_single_stream(url, part_file, total_size):
+    """Descarga secuencial en una sola conexión, reanudando desde el archivo parcial si existe"""
+    progress = {"downloaded": _part_size(part_file)}
+    
+    def on_chunk(n):
+        progress["downloaded"] += n
+        _print_progress(progress["downloaded"], total_size)
+    
+    # Parcial ya completo: pedir "bytes=N-" devolvería 416 en cada ejecución
+    if total_size and progress["downloaded"] >= total_size:
+        return [part_file]
+    
+    try:
+        _fetch_into(url, part_file, 0, None, on_chunk)
+    except RangeNotSupportedError:
+        # El servidor ignoró el Range: se descarta el parcial y se empieza desde cero
+        part_file.unlink()
+        progress["downloaded"] = 0
+        _fetch_into(url, part_file, 0, None, on_chunk)
+    return [part_file]
+
+
+def _download_parallel(url, part_file, total_size, workers=DOWNLOAD_WORKERS):
+    """
+    Descarga el archivo en rangos disjuntos con varias conexiones simultáneas.
+    Cada rango se guarda en su propio archivo parcial, de modo que una descarga
+    interrumpida se reanuda rango por rango.
+    """
+    part_size = -(-total_size // workers)  # División con redondeo hacia arriba
+    segments = [
+        (part_file.with_name(f"{part_file.name}{i}"), start, min(start + part_size, total_size) - 1)
+        for i, start in enumerate(range(0, total_size, part_size))
+    ]
+    
+    progress = {"downloaded": sum(_part_size(path) for path, _, _ in segments)}
+    progress_lock = threading.Lock()
+    
+    def on_chunk(n):
+        with progress_lock:
+            progress["downloaded"] += n
+            _print_progress(progress["downloaded"], total_size)
+    
+    def fetch_segment(segment):
+        path, start, end = segment
+        _fetch_into(url, path, start, end, on_chunk)
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # list() propaga la primera excepción de cualquier hilo
+        list(executor.map(fetch_segment, segments))
+    
+    return [path for path, _, _ in segments]
+
+
+def _assemble_and_verify(parts, model_file, total_size):
+    """
+    Une los archivos parciales en model_file y verifica tamaño y SHA-256.
+    Lanza IntegrityError si no coinciden.
+    """
+    tmp_file = model_file.with_name(model_file.name + ".tmp")
+    sha256 = hashlib.sha256()
+    
+    with open(tmp_file, "wb") as out:
+        for part in parts:
+            with open(part, "rb") as f:
+                while True:
+                    chunk = f.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    sha256.update(chunk)
+                    out.write(chunk)
+    
+    size = tmp_file.stat().st_size
+    digest = sha256.hexdigest()
+    if (total_size and size != total_size) or (MODEL_SHA256 and digest != MODEL_SHA256):
+        tmp_file.unlink()
+        raise IntegrityError(f"Tamaño {size} / SHA-256 {digest} no coinciden con lo esperado")
+    
+    os.replace(tmp_file, model_file)
+    for part in parts:
+        part.unlink()
+    return digest
+
+
+def _remove_parts(model_file):
+    """Elimina archivos parciales de una descarga anterior"""
+    for path in model_file.parent.glob(model_file.name + ".part*"):
+        path.unlink()
+
+
 def download_vgg_face_model():
     """Descarga el modelo VGG-Face de DeepFace manualmente"""
     
@@ -39,19 +208,47 @@ def download_vgg_face_model():
     print("Por favor, ten paciencia.\n")
     
     try:
-        def show_progress(block_num, block_size, total_size):
-            """Muestra el progreso de la descarga"""
-            downloaded = block_num * block_size
-            percent = min(downloaded * 100 / total_size, 100)
-            downloaded_mb = downloaded / (1024 * 1024)
-            total_mb = total_size / (1024 * 1024)
+        print("Iniciando descarga...")
+        final_url, total_size, accepts_ranges, etag = _get_remote_info(model_url)
+        
+        # Los parciales solo se reanudan si el archivo remoto es el mismo (mismo ETag)
+        part_file = model_file.with_name(model_file.name + ".part")
+        etag_file = model_file.with_name(model_file.name + ".etag")
+        previous_etag = etag_file.read_text(encoding="utf-8") if etag_file.exists() else None
+        if previous_etag != etag:
+            _remove_parts(model_file)
+        etag_file.write_text(etag, encoding="utf-8")
+        if any(model_file.parent.glob(model_file.name + ".part*")):
+            print("[INFO] Reanudando descarga anterior...")
+        
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            if accepts_ranges and total_size > 0 and not part_file.exists():
+                try:
+                    parts = _download_parallel(final_url, part_file, total_size)
+                except RangeNotSupportedError:
+                    print("\n[INFO] El servidor no admite descargas por rangos, usando una sola conexión...")
+                    _remove_parts(model_file)
+                    accepts_ranges = False
+                    parts = _download_single_stream(final_url, part_file, total_size)
+            else:
+                if not accepts_ranges:
+                    # Sin soporte de rangos no se puede reanudar
+                    _remove_parts(model_file)
+                parts = _download_single_stream(final_url, part_file, total_size)
             
-            # Actualizar en la misma línea
-            sys.stdout.write(f"\r[Descargando] {percent:.1f}% - {downloaded_mb:.1f} MB / {total_mb:.1f} MB")
-            sys.stdout.flush()
+            try:
+                digest = _assemble_and_verify(parts, model_file, total_size)
+                break
+            except IntegrityError as e:
+                print(f"\n[WARNING] Verificación fallida: {e}")
+                _remove_parts(model_file)
+                if attempt == MAX_ATTEMPTS:
+                    raise
+                print("[INFO] Descargando de nuevo...")
+        
+        etag_file.unlink()
+        print(f"\n[INFO] SHA-256: {digest}")
         
-        print("Iniciando descarga...")
-        urllib.request.urlretrieve(model_url, model_file, reporthook=show_progress)
         print("\n\n[OK] ¡Descarga completada exitosamente!")
         print(f"[OK] Modelo guardado en: {model_file}")
         
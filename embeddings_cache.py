@@ -1,6 +1,11 @@
 """
 Módulo de caché de embeddings con patrón Cache-Aside
 """
+import os
+import json
+import asyncio
+import tempfile
+import threading
 from typing import List, Tuple, Optional
 from datetime import datetime
 from cachetools import TTLCache
@@ -8,6 +13,18 @@ import numpy as np
 from database import Database
 from logger_config import logger
 
+# FAISS es opcional: si no está instalado se usa búsqueda exacta por fuerza bruta
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+# numba es opcional: permite compilar un comparador especializado para la dimensión del caché
+try:
+    import numba
+except ImportError:
+    numba = None
+
 # Clave del caché
 CACHE_KEY = "embeddings:all"
 
@@ -17,6 +34,117 @@ CACHE_TTL = 3600
 # Máximo de elementos en caché (1 es suficiente para nuestro caso)
 CACHE_MAXSIZE = 1
 
+# Desviación máxima de la norma para considerar una fila ya normalizada
+NORM_TOLERANCE = 1e-3
+
+# Número mínimo de embeddings para construir un índice ANN (HNSW); por debajo la búsqueda exacta es suficiente
+ANN_MIN_SIZE = int(os.getenv('EMBEDDINGS_ANN_MIN_SIZE', 5000))
+
+# Vecinos por nodo del grafo HNSW
+HNSW_M = 32
+
+# Dimensión máxima para compilar el kernel top-k especializado a la dimensión; por encima, BLAS (matrix @ query) es más rápido
+SPECIALIZE_MAX_DIM = int(os.getenv('EMBEDDINGS_SPECIALIZE_MAX_DIM', 256))
+
+# Directorio del snapshot en disco de la matriz (sobrevive reinicios; vacío para desactivarlo)
+SNAPSHOT_DIR = os.getenv('EMBEDDINGS_SNAPSHOT_DIR', 'cache')
+
+# Archivos del snapshot: matrices .npy con nombre único por escritura (se abren con mmap) y
+# metadatos JSON, que indican qué matriz les corresponde
+SNAPSHOT_MATRIX_PREFIX = "embeddings_matrix_"
+SNAPSHOT_META_FILE = "embeddings_meta.json"
+
+# Mantener además una copia int8 de la galería (1/4 de memoria) y usarla en la búsqueda exacta
+INT8_GALLERY = os.getenv('EMBEDDINGS_INT8_GALLERY', 'false').lower() == 'true'
+
+# Candidatos int8 por resultado pedido: se vuelven a puntuar en float32 antes de quedarse con los k mejores
+INT8_RERANK_FACTOR = 4
+
+
+def _quantize_rows(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Cuantización simétrica por fila a int8: fila ≈ q * scale, con q en [-127, 127]
+    
+    Args:
+        matrix: Matriz float32 (N, D) o vector (D,)
+        
+    Returns:
+        Tupla (q, scales): q int8 con la misma forma y escalas float32 (N,) o escalar
+    """
+    max_abs = np.abs(matrix).max(axis=-1)
+    scales = np.where(max_abs > 0, max_abs / 127, 1.0).astype(np.float32)
+    quantized = np.rint(matrix / np.expand_dims(scales, -1)).astype(np.int8)
+    return quantized, scales
+
+
+def _int8_topk(gallery: np.ndarray, scales: np.ndarray, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k sobre la galería int8: producto punto entero (acumulado en int32) reescalado a float"""
+    query_q, query_scale = _quantize_rows(query)
+    similarities = np.einsum('nd,d->n', gallery, query_q, dtype=np.int32) * (scales * query_scale)
+    top = np.argpartition(similarities, -k)[-k:]
+    top = top[np.argsort(similarities[top])[::-1]]
+    return top, similarities[top].astype(np.float32)
+
+
+def _matmul_topk(matrix: np.ndarray, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k genérico: similitudes vía BLAS y selección parcial con argpartition"""
+    similarities = matrix @ query
+    top = np.argpartition(similarities, -k)[-k:]
+    top = top[np.argsort(similarities[top])[::-1]]
+    return top, similarities[top]
+
+
+def _topk_scores(matrix, query, k, dim):
+    """
+    Top-k en un solo recorrido: producto punto por fila e inserción en un buffer ordenado de k
+    (sin arreglo temporal de N similitudes). Se compila con numba si está disponible.
+    
+    dim se recibe como argumento para que _make_topk pueda fijarlo como constante.
+    """
+    n = matrix.shape[0]
+    top_idx = np.full(k, -1, dtype=np.int64)
+    top_val = np.full(k, -np.inf, dtype=np.float32)
+    for i in range(n):
+        acc = np.float32(0.0)
+        for j in range(dim):
+            acc += matrix[i, j] * query[j]
+        if acc > top_val[k - 1]:
+            pos = k - 1
+            while pos > 0 and top_val[pos - 1] < acc:
+                top_val[pos] = top_val[pos - 1]
+                top_idx[pos] = top_idx[pos - 1]
+                pos -= 1
+            top_val[pos] = acc
+            top_idx[pos] = i
+    return top_idx, top_val
+
+
+# Flags de fastmath: reasociar y contraer (FMA) la reducción, pero sin nnan/ninf, que harían
+# indefinidos el centinela -inf y las comparaciones con NaN (search() espera índice -1 en filas no finitas)
+FASTMATH_FLAGS = {'reassoc', 'contract', 'arcp'}
+
+if numba is not None:
+    # Función de módulo: se puede cachear en disco; inline='always' la inserta en el kernel de
+    # _make_topk, donde dim pasa a ser una constante de compilación
+    _topk_scores = numba.njit(cache=True, fastmath=FASTMATH_FLAGS, inline='always')(_topk_scores)
+
+
+def _make_topk(dim: int):
+    """
+    Crea el kernel top-k con la dimensión fija como constante (bucle interno de longitud conocida:
+    LLVM lo puede desenrollar y vectorizar). Requiere numba.
+    
+    Args:
+        dim: Dimensión de los embeddings
+        
+    Returns:
+        Función compilada topk(matrix, query, k) -> (índices, scores)
+    """
+    def topk(matrix, query, k):
+        return _topk_scores(matrix, query, k, dim)
+    # Las funciones anidadas no se pueden cachear en disco: se compila una vez por dimensión y proceso
+    return numba.njit(fastmath=FASTMATH_FLAGS)(topk)
+
 
 class EmbeddingsCache:
     """
@@ -38,43 +166,410 @@ class EmbeddingsCache:
             maxsize: Tamaño máximo del caché (default: 1)
         """
         self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        # Single-flight: solo un hilo recarga desde BD en un caché miss, el resto espera
+        self._load_lock = threading.Lock()
+        # El lock asíncrono se crea al primer uso, dentro del event loop que lo usa
+        self._async_load_lock: Optional[asyncio.Lock] = None
+        # El snapshot en disco solo se consulta en la primera carga del proceso
+        self._snapshot_checked = False
+        # Hay cambios hechos por este proceso que el snapshot no refleja (se reescribe en la próxima carga)
+        self._snapshot_dirty = False
+        # Función top-k usada en la búsqueda exacta y dimensión para la que fue creada
+        self._topk = _matmul_topk
+        self._topk_dim = 0
         logger.info(f"Caché de embeddings inicializado (TTL: {ttl}s)")
     
-    def get_all_embeddings(self) -> List[Tuple[int, int, np.ndarray, datetime, bool]]:
+    def _build_index(self, matrix: np.ndarray):
+        """
+        Construye un índice HNSW de producto interno sobre la matriz normalizada
+        
+        Returns:
+            Índice FAISS o None si FAISS no está disponible o hay pocos embeddings
+        """
+        if faiss is None or matrix.shape[0] < ANN_MIN_SIZE:
+            return None
+        
+        # Con filas normalizadas, el producto interno es la similitud coseno
+        index = faiss.IndexHNSWFlat(matrix.shape[1], HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.add(matrix)
+        logger.bind(count=matrix.shape[0], dim=matrix.shape[1]).info("Índice HNSW construido")
+        return index
+    
+    def _specialize(self, dim: int):
+        """
+        Elige (una sola vez por dimensión) la función top-k de la búsqueda exacta:
+        - numba y dimensión <= SPECIALIZE_MAX_DIM: kernel compilado con la dimensión fija (_make_topk)
+        - en otro caso: BLAS + argpartition (_matmul_topk)
+        
+        Args:
+            dim: Dimensión de los embeddings cargados
+        """
+        if dim == self._topk_dim:
+            return
+        self._topk_dim = dim
+        
+        if numba is None or dim > SPECIALIZE_MAX_DIM:
+            self._topk = _matmul_topk
+            return
+        
+        self._topk = _make_topk(dim)
+        logger.bind(dim=dim).info("Top-k especializado para la dimensión compilado")
+    
+    def _make_entry(self, ids: np.ndarray, user_ids: np.ndarray,
+                    matrix: np.ndarray, created_at: List[datetime],
+                    gallery_int8: Optional[tuple] = None, index=None) -> tuple:
+        """
+        Arma una entrada del caché con las estructuras de búsqueda derivadas de la matriz
+        
+        Args:
+            gallery_int8: Copia int8 ya cuantizada de la matriz (None = cuantizarla si está habilitada)
+            index: Índice ANN ya construido sobre la matriz (None = construirlo si corresponde)
+        
+        Returns:
+            Tupla (embedding_ids, user_ids, matrix, created_at, index, gallery_int8)
+        """
+        self._specialize(matrix.shape[1])
+        if INT8_GALLERY and gallery_int8 is None:
+            gallery_int8 = _quantize_rows(matrix)
+        if index is None:
+            index = self._build_index(matrix)
+        return ids, user_ids, matrix, created_at, index, gallery_int8
+    
+    def _get_entry(self) -> tuple:
         """
-        Obtiene todos los embeddings usando patrón Cache-Aside
+        Obtiene la entrada completa del caché (embeddings + índice ANN) usando patrón Cache-Aside
         
         Returns:
-            Lista de embeddings: (embedding_id, user_id, embedding, created_at, estado)
+            Tupla (embedding_ids, user_ids, matrix, created_at, index, gallery_int8)
         """
         # 1. Intentar obtener del caché
-        cached_embeddings = self.cache.get(CACHE_KEY)
+        entry = self.cache.get(CACHE_KEY)
         
-        if cached_embeddings is not None:
-            logger.debug("Obteniendo embeddings desde caché", extra={"count": len(cached_embeddings)})
-            return cached_embeddings
+        if entry is not None:
+            logger.bind(count=len(entry[0])).debug("Obteniendo embeddings desde caché")
+            return entry
+        
+        with self._load_lock:
+            # Otro hilo pudo haber llenado el caché mientras esperábamos el lock
+            entry = self.cache.get(CACHE_KEY)
+            if entry is not None:
+                return entry
+            return self._load_entry()
+    
+    def _load_entry(self) -> tuple:
+        """
+        Carga los embeddings desde BD y los guarda en caché (llamar con _load_lock tomado)
+        
+        Returns:
+            Tupla (embedding_ids, user_ids, matrix, created_at, index, gallery_int8)
+        """
+        # Huella de la tabla tomada antes de leer: si cambia durante la carga, el snapshot queda obsoleto.
+        # Solo hace falta al arrancar o si hay que reescribir el snapshot; las recargas por TTL no lo tocan
+        needs_state = SNAPSHOT_DIR and (not self._snapshot_checked or self._snapshot_dirty)
+        state = Database.get_embeddings_state() if needs_state else None
+        
+        if not self._snapshot_checked:
+            self._snapshot_checked = True
+            entry = self._load_snapshot(state)
+            if entry is not None:
+                self.cache[CACHE_KEY] = entry
+                return entry
         
         # 2. Si no está en caché, obtener de BD
         logger.debug("Caché miss - obteniendo embeddings desde BD")
-        embeddings = Database.get_all_embeddings()
-        
-        if embeddings:
-            # 3. Guardar en caché para próximas consultas
-            self.cache[CACHE_KEY] = embeddings
-            logger.info(
-                "Embeddings cargados desde BD y guardados en caché",
-                extra={"count": len(embeddings)}
+        ids, user_ids, matrix, created_at, estados = Database.get_all_embeddings_matrix()
+        
+        # Solo se comparan embeddings con estado activo
+        if not estados.all():
+            ids, user_ids, matrix = ids[estados], user_ids[estados], matrix[estados]
+            created_at = [c for c, activo in zip(created_at, estados) if activo]
+        
+        if len(ids) == 0:
+            logger.warning("No se encontraron embeddings en BD")
+            return ids, user_ids, matrix, created_at, None, None
+        
+        # Los embeddings se guardan normalizados; solo se dividen las filas que no lo están
+        # (registros anteriores a la migración o int8 decuantizados)
+        norms = np.sqrt(np.einsum('ij,ij->i', matrix, matrix))
+        stale = np.abs(norms - 1.0) > NORM_TOLERANCE
+        if stale.any():
+            matrix[stale] /= (norms[stale, None] + 1e-10)
+        
+        entry = self._make_entry(ids, user_ids, matrix, created_at)
+        if state is not None:
+            self._save_snapshot(state, ids, user_ids, matrix, created_at)
+            self._snapshot_dirty = False
+        
+        # 3. Guardar en caché para próximas consultas
+        self.cache[CACHE_KEY] = entry
+        logger.bind(count=len(ids), shape=matrix.shape).info("Embeddings cargados desde BD y guardados en caché")
+        
+        return entry
+    
+    def _load_snapshot(self, state) -> Optional[tuple]:
+        """
+        Abre el snapshot en disco si corresponde al estado actual de la BD
+        
+        Args:
+            state: Huella de la tabla (total, activos, último creado_en) o None
+            
+        Returns:
+            Entrada del caché con la matriz mapeada en memoria (solo lectura) o None
+        """
+        if state is None:
+            return None
+        
+        meta_path = os.path.join(SNAPSHOT_DIR, SNAPSHOT_META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            
+            if meta.get("state") != self._state_to_json(state):
+                logger.info("Snapshot de embeddings obsoleto, se recarga desde BD")
+                return None
+            
+            # mmap: sin copia ni deserialización, las páginas se leen bajo demanda
+            matrix = np.load(os.path.join(SNAPSHOT_DIR, meta["matrix_file"]), mmap_mode='r')
+            ids = np.asarray(meta["ids"], dtype=np.int64)
+            user_ids = np.asarray(meta["user_ids"], dtype=np.int64)
+            created_at = [datetime.fromisoformat(c) if c else None for c in meta["created_at"]]
+            
+            if matrix.ndim != 2 or matrix.shape[0] != len(ids) or len(ids) != len(user_ids):
+                logger.warning("Snapshot de embeddings inconsistente, se ignora")
+                return None
+            
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"No se pudo leer el snapshot de embeddings: {e}")
+            return None
+        
+        logger.bind(count=len(ids), shape=matrix.shape).info("Embeddings cargados desde snapshot en disco")
+        return self._make_entry(ids, user_ids, matrix, created_at)
+    
+    def _save_snapshot(self, state, ids: np.ndarray, user_ids: np.ndarray,
+                       matrix: np.ndarray, created_at: List[datetime]):
+        """
+        Escribe la matriz y sus metadatos en disco para el próximo arranque
+        
+        Varios procesos (workers) pueden guardar a la vez: cada escritura usa archivos temporales
+        propios (tempfile) y la matriz lleva un nombre único que los metadatos referencian, así
+        que publicar los metadatos con os.replace nunca empareja datos de dos escrituras distintas.
+        """
+        if state is None:
+            return
+        
+        matrix_path = meta_tmp_path = None
+        try:
+            os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+            meta_path = os.path.join(SNAPSHOT_DIR, SNAPSHOT_META_FILE)
+            
+            with tempfile.NamedTemporaryFile('wb', dir=SNAPSHOT_DIR, prefix=SNAPSHOT_MATRIX_PREFIX,
+                                             suffix='.npy', delete=False) as f:
+                matrix_path = f.name
+                np.save(f, matrix)
+            meta = {
+                "ids": ids.tolist(),
+                "user_ids": user_ids.tolist(),
+                "created_at": [c.isoformat() if c else None for c in created_at],
+                "state": self._state_to_json(state),
+                "matrix_file": os.path.basename(matrix_path)
+            }
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=SNAPSHOT_DIR,
+                                             prefix=SNAPSHOT_META_FILE, suffix='.tmp', delete=False) as f:
+                meta_tmp_path = f.name
+                json.dump(meta, f)
+            
+            previous_matrix = self._snapshot_matrix_file(meta_path)
+            # Los metadatos se publican al final: un snapshot a medias nunca coincide con la BD
+            os.replace(meta_tmp_path, meta_path)
+            meta_tmp_path = None
+            matrix_path = None
+            
+            # La matriz anterior ya no está referenciada (en Windows puede seguir abierta con mmap)
+            if previous_matrix:
+                try:
+                    os.remove(os.path.join(SNAPSHOT_DIR, previous_matrix))
+                except OSError:
+                    pass
+            
+        except OSError as e:
+            logger.warning(f"No se pudo guardar el snapshot de embeddings: {e}")
+        finally:
+            # Limpiar temporales de una escritura fallida
+            for path in (matrix_path, meta_tmp_path):
+                if path:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+    
+    @staticmethod
+    def _snapshot_matrix_file(meta_path: str) -> Optional[str]:
+        """
+        Nombre del archivo de matriz referenciado por los metadatos actuales (None si no hay)
+        """
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get("matrix_file")
+        except (OSError, ValueError, AttributeError):
+            return None
+    
+    @staticmethod
+    def _state_to_json(state) -> list:
+        """
+        Convierte la huella de la tabla a una lista serializable en JSON
+        """
+        total, activos, ultimo = state
+        return [total, activos, ultimo.isoformat() if ultimo else None]
+    
+    def get_all_embeddings(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[datetime]]:
+        """
+        Obtiene todos los embeddings activos usando patrón Cache-Aside
+        
+        Las filas de la matriz se normalizan (norma L2) al llenar el caché, de modo que
+        la similitud coseno de una consulta se reduce a un único producto ``matrix @ query``.
+        
+        Returns:
+            Tupla (embedding_ids, user_ids, matrix, created_at):
+            - embedding_ids: Array int64 (N,)
+            - user_ids: Array int64 (N,)
+            - matrix: Matriz float32 (N, D) contigua con filas normalizadas
+            - created_at: Lista de fechas de creación en el mismo orden
+        """
+        return self._get_entry()[:4]
+    
+    async def get_all_embeddings_async(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[datetime]]:
+        """
+        Variante asíncrona de get_all_embeddings para endpoints async
+        
+        En un caché miss, solo una corrutina lanza la carga (en un hilo del executor para no
+        bloquear el event loop); las demás esperan el lock y leen el caché ya lleno.
+        
+        Returns:
+            Tupla (embedding_ids, user_ids, matrix, created_at)
+        """
+        entry = self.cache.get(CACHE_KEY)
+        if entry is not None:
+            return entry[:4]
+        
+        if self._async_load_lock is None:
+            self._async_load_lock = asyncio.Lock()
+        
+        async with self._async_load_lock:
+            loop = asyncio.get_running_loop()
+            entry = await loop.run_in_executor(None, self._get_entry)
+        return entry[:4]
+    
+    def search(self, query: np.ndarray, k: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Busca los k embeddings más similares a la consulta
+        
+        Usa el índice HNSW si existe (búsqueda aproximada, O(log N)); si no, búsqueda exacta
+        con un producto matriz-vector (sobre la copia int8 si está habilitada) y selección
+        parcial de los k mejores.
+        
+        Args:
+            query: Embedding de consulta
+            k: Número de resultados
+            
+        Returns:
+            Tupla (user_ids, scores) ordenada por similitud descendente, con scores en [-1, 1]
+            (vacía si no hay embeddings o la dimensión de la consulta no coincide)
+        """
+        _, user_ids, matrix, _, index, gallery_int8 = self._get_entry()
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if len(user_ids) == 0:
+            return empty
+        
+        query = np.asarray(query, dtype=np.float32).ravel()
+        if query.shape[0] != matrix.shape[1]:
+            logger.error(
+                f"Los embeddings almacenados tienen dimensión {matrix.shape[1]}, "
+                f"esperado {query.shape[0]}"
             )
+            return empty
+        query = query / (np.linalg.norm(query) + 1e-10)
+        k = min(k, len(user_ids))
+        
+        if index is not None:
+            scores, positions = index.search(query.reshape(1, -1), k)
+            top, scores = positions[0], scores[0]
+        elif gallery_int8 is not None:
+            # La galería int8 solo preselecciona candidatos; la similitud devuelta (comparada
+            # con el umbral) se recalcula en float32 sobre esas pocas filas
+            candidates, _ = _int8_topk(*gallery_int8, query, min(k * INT8_RERANK_FACTOR, len(user_ids)))
+            exact = matrix[candidates] @ query
+            order = np.argsort(exact)[::-1][:k]
+            top, scores = candidates[order], exact[order]
         else:
-            logger.warning("No se encontraron embeddings en BD")
+            top, scores = self._topk(matrix, query, k)
+        
+        # Posiciones sin resultado: -1 del índice HNSW o del top-k compilado (filas no finitas);
+        # argpartition, en cambio, deja los NaN entre los k mejores
+        valid = (top >= 0) & np.isfinite(scores)
+        top, scores = top[valid], scores[valid]
+        
+        # Igual que en calculate_similarities_vectorized: errores de punto flotante fuera de [-1, 1]
+        return user_ids[top], np.clip(scores, -1.0, 1.0)
+    
+    def add_embedding(self, embedding_id: int, user_id: int, embedding: np.ndarray):
+        """
+        Agrega un embedding recién registrado al caché sin recargar toda la tabla
+        
+        Se construyen arrays nuevos en lugar de modificar los existentes, así las consultas
+        en curso siguen usando la entrada anterior sin verse afectadas. Si el caché está vacío
+        no se hace nada (la próxima consulta lo cargará desde BD).
         
-        return embeddings
+        Args:
+            embedding_id: ID del embedding insertado
+            user_id: ID del usuario
+            embedding: Embedding insertado
+        """
+        with self._load_lock:
+            entry = self.cache.get(CACHE_KEY)
+            if entry is None:
+                return
+            
+            ids, user_ids, matrix, created_at, index, gallery_int8 = entry
+            row = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+            if len(ids) > 0 and row.shape[1] != matrix.shape[1]:
+                # Dimensión distinta (cambio de modelo): recargar todo en la próxima consulta
+                del self.cache[CACHE_KEY]
+                return
+            row = row / (np.linalg.norm(row) + 1e-10)
+            
+            matrix = np.concatenate([matrix, row]) if len(ids) > 0 else row
+            if gallery_int8 is not None:
+                # Solo se cuantiza la fila nueva (la escala es por fila)
+                row_q, row_scale = _quantize_rows(row)
+                gallery_int8 = (np.concatenate([gallery_int8[0], row_q]),
+                                np.concatenate([gallery_int8[1], row_scale]))
+            if index is not None:
+                # Insertar la fila en una copia del grafo HNSW (sin reconstruirlo); la copia
+                # mantiene intacto el índice que usan las búsquedas en curso
+                index = faiss.clone_index(index)
+                index.add(row)
+            self.cache[CACHE_KEY] = self._make_entry(
+                np.append(ids, np.int64(embedding_id)),
+                np.append(user_ids, np.int64(user_id)),
+                matrix,
+                created_at + [datetime.now()],
+                gallery_int8,
+                index
+            )
+            self._snapshot_dirty = True
+            logger.bind(user_id=user_id, count=matrix.shape[0]).info("Embedding agregado al caché")
     
     def clear_cache(self):
         """
         Limpia el caché (invalidación manual)
         """
+        # La invalidación manual indica datos cambiados: la próxima carga reescribe el snapshot
+        self._snapshot_dirty = True
         if CACHE_KEY in self.cache:
+            # La entrada incluye el índice ANN, que se descarta junto con los embeddings
             del self.cache[CACHE_KEY]
             logger.info("Caché de embeddings invalidado")
         else:
@@ -88,10 +583,17 @@ class EmbeddingsCache:
             Dict con información del caché
         """
         cached_embeddings = self.cache.get(CACHE_KEY)
+        matrix = cached_embeddings[2] if cached_embeddings is not None else None
+        index = cached_embeddings[4] if cached_embeddings is not None else None
+        gallery_int8 = cached_embeddings[5] if cached_embeddings is not None else None
         
         return {
             "has_cache": cached_embeddings is not None,
-            "embeddings_count": len(cached_embeddings) if cached_embeddings else 0,
+            "embeddings_count": matrix.shape[0] if matrix is not None else 0,
+            "matrix_shape": list(matrix.shape) if matrix is not None else None,
+            "matrix_nbytes": int(matrix.nbytes) if matrix is not None else 0,
+            "ann_index": index is not None,
+            "int8_gallery_nbytes": int(gallery_int8[0].nbytes) if gallery_int8 is not None else 0,
             "cache_size": len(self.cache),
             "maxsize": self.cache.maxsize,
             "ttl": self.cache.ttl
@@ -121,17 +623,36 @@ def get_embeddings_cache() -> EmbeddingsCache:
     return _embeddings_cache_instance
 
 
-def get_all_embeddings_with_cache() -> List[Tuple[int, int, np.ndarray, datetime, bool]]:
+def get_all_embeddings_with_cache() -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[datetime]]:
     """
     Función helper para obtener embeddings usando caché
     
     Returns:
-        Lista de embeddings: (embedding_id, user_id, embedding, created_at, estado)
+        Tupla (embedding_ids, user_ids, matrix, created_at) con filas normalizadas
     """
     cache = get_embeddings_cache()
     return cache.get_all_embeddings()
 
 
+async def get_all_embeddings_with_cache_async() -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[datetime]]:
+    """
+    Función helper asíncrona para obtener embeddings usando caché
+    
+    Returns:
+        Tupla (embedding_ids, user_ids, matrix, created_at) con filas normalizadas
+    """
+    cache = get_embeddings_cache()
+    return await cache.get_all_embeddings_async()
+
+
+def add_embedding_to_cache(embedding_id: int, user_id: int, embedding: np.ndarray):
+    """
+    Función helper para agregar un embedding recién registrado al caché
+    """
+    cache = get_embeddings_cache()
+    cache.add_embedding(embedding_id, user_id, embedding)
+
+
 def clear_embeddings_cache():
     """
     Función helper para limpiar el caché
@@ -139,3 +660,35 @@ def clear_embeddings_cache():
     cache = get_embeddings_cache()
     cache.clear_cache()
 
+
+def invalidate_embeddings_snapshot():
+    """
+    Borra el snapshot en disco (p. ej. tras reescribir embeddings en el sitio con migrate_normalize,
+    que no cambia la huella de la tabla); el próximo arranque carga desde BD y lo vuelve a escribir
+    """
+    if not SNAPSHOT_DIR:
+        return
+    
+    meta_path = os.path.join(SNAPSHOT_DIR, SNAPSHOT_META_FILE)
+    matrix_file = EmbeddingsCache._snapshot_matrix_file(meta_path)
+    paths = [meta_path] + ([os.path.join(SNAPSHOT_DIR, matrix_file)] if matrix_file else [])
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"No se pudo borrar el snapshot de embeddings: {e}")
+    logger.info("Snapshot de embeddings invalidado")
+
+
+
+def search_embeddings_with_cache(query: np.ndarray, k: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Función helper para buscar los k embeddings más similares usando el caché
+    
+    Returns:
+        Tupla (user_ids, scores) ordenada por similitud descendente
+    """
+    cache = get_embeddings_cache()
+    return cache.search(query, k)
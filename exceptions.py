@@ -7,12 +7,19 @@ from typing import Optional
 class FaceRecognitionException(Exception):
     """
     Excepción base para todas las excepciones del sistema de reconocimiento facial
+    
+    Cada subclase define su código y estado HTTP por defecto como atributos de clase,
+    de modo que construir la excepción no recalcula nada en los caminos frecuentes.
     """
+    
+    _default_code: Optional[str] = None
+    _default_status: int = 500
+    
     def __init__(
         self, 
         message: str, 
         error_code: Optional[str] = None,
-        status_code: int = 500
+        status_code: Optional[int] = None
     ):
         """
         Args:
@@ -21,9 +28,9 @@ class FaceRecognitionException(Exception):
             status_code: Código HTTP apropiado para este error
         """
         self.message = message
-        self.error_code = error_code or self.__class__.__name__
-        self.status_code = status_code
-        super().__init__(self.message)
+        self.error_code = error_code or self._default_code or self.__class__.__name__
+        self.status_code = status_code or self._default_status
+        super().__init__(message)
     
     def to_dict(self) -> dict:
         """
@@ -41,89 +48,75 @@ class FaceRecognitionException(Exception):
 
 class FaceNotFoundError(FaceRecognitionException):
     """Excepción cuando no se detecta un rostro en la imagen"""
+    _default_code = "FACE_NOT_FOUND"
+    _default_status = 400
+    
     def __init__(self, message: str = "No se detectó ningún rostro en la imagen"):
-        super().__init__(
-            message=message,
-            error_code="FACE_NOT_FOUND",
-            status_code=400
-        )
+        super().__init__(message)
 
 
 class InvalidImageError(FaceRecognitionException):
     """Excepción cuando la imagen es inválida o corrupta"""
+    _default_code = "INVALID_IMAGE"
+    _default_status = 400
+    
     def __init__(self, message: str = "El archivo no es una imagen válida"):
-        super().__init__(
-            message=message,
-            error_code="INVALID_IMAGE",
-            status_code=400
-        )
+        super().__init__(message)
 
 
 class UserNotFoundError(FaceRecognitionException):
     """Excepción cuando un usuario no se encuentra"""
+    _default_code = "USER_NOT_FOUND"
+    _default_status = 404
+    
     def __init__(self, user_id: str, message: Optional[str] = None):
         if message is None:
             message = f"Usuario con ID {user_id} no encontrado"
-        super().__init__(
-            message=message,
-            error_code="USER_NOT_FOUND",
-            status_code=404
-        )
+        super().__init__(message)
 
 
 class DuplicateUserError(FaceRecognitionException):
     """Excepción cuando se intenta registrar un usuario que ya existe"""
+    _default_code = "DUPLICATE_USER"
+    _default_status = 409  # Conflict
+    
     def __init__(self, user_id: str, message: Optional[str] = None):
         if message is None:
             message = f"El usuario {user_id} ya está registrado"
-        super().__init__(
-            message=message,
-            error_code="DUPLICATE_USER",
-            status_code=409  # Conflict
-        )
+        super().__init__(message)
 
 
 class DatabaseError(FaceRecognitionException):
     """Excepción para errores de base de datos"""
+    _default_code = "DATABASE_ERROR"
+    _default_status = 503  # Service Unavailable
+    
     def __init__(self, message: str = "Error al conectar con la base de datos"):
-        super().__init__(
-            message=message,
-            error_code="DATABASE_ERROR",
-            status_code=503  # Service Unavailable
-        )
+        super().__init__(message)
 
 
 class ValidationError(FaceRecognitionException):
     """Excepción para errores de validación"""
-    def __init__(self, message: str, error_code: str = "VALIDATION_ERROR"):
-        super().__init__(
-            message=message,
-            error_code=error_code,
-            status_code=400
-        )
+    _default_code = "VALIDATION_ERROR"
+    _default_status = 400
+    
+    def __init__(self, message: str, error_code: Optional[str] = None):
+        super().__init__(message, error_code=error_code)
 
 
 class AuthenticationError(FaceRecognitionException):
     """Excepción para errores de autenticación (para uso futuro)"""
+    _default_code = "AUTHENTICATION_ERROR"
+    _default_status = 401  # Unauthorized
+    
     def __init__(self, message: str = "Error de autenticación"):
-        super().__init__(
-            message=message,
-            error_code="AUTHENTICATION_ERROR",
-            status_code=401  # Unauthorized
-        )
+        super().__init__(message)
 
 
 class AuthorizationError(FaceRecognitionException):
     """Excepción para errores de autorización (para uso futuro)"""
+    _default_code = "AUTHORIZATION_ERROR"
+    _default_status = 403  # Forbidden
+    
     def __init__(self, message: str = "No tienes permiso para realizar esta acción"):
-        super().__init__(
-            message=message,
-            error_code="AUTHORIZATION_ERROR",
-            status_code=403  # Forbidden
-        )
-
-
-
-
-
-
+        super().__init__(message)
@@ -3,11 +3,13 @@ import sys
 import cv2
 import numpy as np
 import threading
+import queue
 import time
+import traceback
+from collections import deque, OrderedDict
 import urllib.request
 import requests
-import uuid
-from pathlib import Path
+from requests.adapters import HTTPAdapter
 from typing import Optional, Tuple
 from tkinter import *
 from tkinter import ttk, messagebox
@@ -34,9 +36,19 @@ class FaceRecognitionApp:
             self.external_api_url = f"http://{host}:{port}/usuario-face-embedding"
             print(f"[INFO] Construyendo EXTERNAL_API_URL desde variables: {self.external_api_url}")
             print(f"[INFO] MAIN_SOURCE_DATA_HOST={host}, MAIN_SOURCE_DATA_PORT={port}")
+        # Sesión HTTP persistente (keep-alive): todas las llamadas a la API reutilizan las conexiones abiertas
+        # en lugar de abrir una conexión TCP nueva por frame
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        self.http.mount('http://', adapter)
+        self.http.mount('https://', adapter)
+        # Memo de la lista de usuarios (timestamp, usuarios): evita repetir GET /users al cambiar de modo
+        self.users_cache = None
+        self.users_cache_ttl = 5.0  # segundos
         # Load confidence interval from environment variable, default to 0.8
         self.threshold = float(os.getenv('CONFIDENCE_INTERVAL', '0.8'))
-        self.detection_count_threshold = 5
+        # Detecciones consecutivas del mismo usuario (dentro de detection_window segundos) para conceder acceso
+        self.detection_count_threshold = max(1, int(os.getenv('LOGIN_CONFIRMATIONS', '1')))
         self.detection_window = 2.0
         
         self.camera = None
@@ -44,15 +56,58 @@ class FaceRecognitionApp:
         self.current_mode = None
         self.current_user_id = None
         self.last_frame = None
-        self.detection_count = {}
-        self.last_detection_time = {}
+        # Últimas detecciones (user_id, timestamp) en un buffer circular de tamaño fijo
+        self.recent_detections = deque(maxlen=self.detection_count_threshold)
         self.access_granted = False  # Flag to prevent multiple access grants
         
         # Optimizaciones para login: throttling y procesamiento asíncrono
         self.processing_request = False  # Flag para evitar requests simultáneos
         self.last_request_time = 0  # Timestamp del último request
-        self.request_interval = 0.8  # Intervalo entre requests en segundos (800ms)
+        # Intervalo mínimo entre requests de verificación en segundos (por defecto 800ms); entre requests
+        # el overlay reutiliza el último resultado
+        self.request_interval = float(os.getenv('LOGIN_VERIFY_INTERVAL', '0.8'))
+        self.verify_jpeg_quality = 85  # Calidad JPEG de los frames de login (menos bytes por request)
+        self.register_jpeg_quality = 95  # Calidad JPEG de la imagen de registro (preserva detalles faciales)
+        self.upload_max_side = 640  # Lado máximo de la ROI enviada (el servidor reduce a FACE_MAX_INPUT_SIDE=640)
         self.face_cascade = None  # Clasificador para detección previa local
+        self.roi_has_face = False  # Resultado de la detección local en el último frame dibujado
+        self.roi_check_interval = 0.1  # La detección Haar de la ROI se repite como máximo cada 100 ms
+        self.last_roi_check_time = 0  # Timestamp de la última detección Haar de la ROI
+        self.roi_check_max_side = 160  # Lado máximo (px) de la ROI reducida sobre la que se detecta el rostro
+        self.frame_index = 0  # Contador de frames procesados por update_video
+        self.roi_gray = None  # ROI en gris reducida de la última detección (se reutiliza para el hash)
+        self.roi_gray_index = -1  # frame_index al que corresponde roi_gray
+        self.last_recognition_status = None  # Texto del último resultado, mostrado en frames omitidos
+        
+        # Memo de frames no reconocidos: hash perceptual (8x8) de la ROI -> timestamp
+        # Un frame casi idéntico a uno ya rechazado no se vuelve a enviar a la API
+        self.negative_hashes = OrderedDict()
+        self.negative_hashes_maxlen = 16
+        self.negative_hash_ttl = 5.0  # segundos
+        self.hash_max_distance = 3  # bits distintos tolerados (distancia de Hamming)
+        # Desviación típica mínima del gris de la ROI: por debajo la escena está oscura o es uniforme
+        # (cámara tapada, sin luz) y no se envía a la API
+        self.roi_min_stddev = 15.0
+        
+        # Worker de reconocimiento persistente: cola acotada de 1 frame, el más reciente reemplaza al pendiente
+        self.recognition_queue = queue.Queue(maxsize=1)
+        self.recognition_thread = threading.Thread(target=self._recognition_worker, daemon=True)
+        self.recognition_thread.start()
+        
+        # Hilo lector de la cámara: publica en latest_frame el frame más reciente (protegido por frame_lock)
+        # y avisa con frame_ready; update_video procesa siempre el último y descarta los atrasados
+        self.frame_lock = threading.Lock()
+        self.frame_ready = threading.Event()
+        self.latest_frame = None
+        self.grabber_thread = None
+        
+        # Vista previa: el hilo de captura deja el último frame listo en la cola y el hilo de Tk lo muestra
+        # con root.after (tkinter no es thread-safe, los widgets solo se tocan desde el hilo principal)
+        self.display_queue = queue.Queue(maxsize=1)
+        # Se consulta la cola dos veces por periodo de cámara (~33 ms): un frame nuevo espera como mucho 15 ms
+        self.display_interval_ms = 15
+        self.display_after_id = None
+        self.preview_photo = None  # PhotoImage 800x600 reutilizado: cada frame se pega encima
         
         # Área guía para posicionar el rostro (para recorte consistente)
         # Define una región central del frame donde el usuario debe posicionar su rostro
@@ -61,10 +116,13 @@ class FaceRecognitionApp:
         self.face_roi_center_y = 0.45  # 45% desde arriba (centro vertical, ligeramente arriba)
         self.face_roi_width_ratio = 0.6  # 60% del ancho del frame (aumentado de 40%)
         self.face_roi_height_ratio = 0.7  # 70% del alto del frame (aumentado de 50%)
+        self.roi_rect = None  # (ancho, alto, coordenadas de la ROI) para el último tamaño de frame
         
         # Cargar clasificador de OpenCV para detección previa local (opcional pero útil)
+        # FACE_CASCADE_PATH permite usar un cascade LBP (p. ej. lbpcascade_frontalface_improved.xml, ~2x más
+        # rápido con características enteras); opencv-python solo incluye los Haar, así que es el valor por defecto
         try:
-            cascade_path = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+            cascade_path = os.getenv('FACE_CASCADE_PATH') or cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
             self.face_cascade = cv2.CascadeClassifier(cascade_path)
             if self.face_cascade.empty():
                 print("[WARN] No se pudo cargar el clasificador de OpenCV, se desactivará detección previa")
@@ -73,27 +131,55 @@ class FaceRecognitionApp:
             print(f"[WARN] Error al cargar clasificador OpenCV: {e}")
             self.face_cascade = None
         
-        self.check_api_connection()
         self.setup_ui()
+        
+        # Comprobar la API en segundo plano: la ventana se muestra sin esperar a los reintentos.
+        # El thread se lanza desde root.after para que mainloop ya esté activo cuando entregue el resultado
+        self.status_label.config(text="Estado: Conectando con la API...")
+        self.root.after(0, lambda: threading.Thread(target=self.check_api_connection, daemon=True).start())
     
     def check_api_connection(self):
-        import time
+        """
+        Comprueba que la API responde (se ejecuta en un thread aparte al iniciar).
+        El resultado se entrega al thread principal con root.after.
+        """
         max_retries = 5
-        retry_delay = 1
+        base_delay = 0.2  # Backoff exponencial: 0.2, 0.4, 0.8, 1.6 s
         
         for attempt in range(max_retries):
             try:
-                # Check health endpoint instead of /users
-                response = requests.get(f"{self.api_base_url}/health/live", timeout=2)
+                # Check health endpoint instead of /users (liveness: respuesta mínima, sin tocar la BD)
+                # Timeout de conexión corto: si la API no escucha, se falla rápido y se reintenta
+                response = self.http.get(f"{self.api_base_url}/health/live", timeout=(0.5, 2))
                 if response.status_code == 200:
                     print("[OK] Conexión con API establecida")
+                    self.root.after(0, self.handle_api_connection_result, None)
                     return
+                # Una respuesta distinta de 200 también es un intento fallido
+                error = f"HTTP {response.status_code}"
             except Exception as e:
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    messagebox.showwarning("Advertencia", f"No se pudo conectar con la API en {self.api_base_url}\n\nEl servidor puede estar iniciando. Intenta nuevamente en unos segundos.\n\nError: {str(e)}")
+                error = str(e)
+            
+            if attempt == max_retries - 1:
+                self.root.after(0, self.handle_api_connection_result, error)
+                return
+            
+            # Backoff tanto si falló la petición como si la API respondió con error
+            time.sleep(base_delay * (2 ** attempt))
+    
+    def handle_api_connection_result(self, error):
+        """
+        Actualiza la interfaz con el resultado de check_api_connection (thread principal).
+        
+        Args:
+            error: None si la API respondió, o el mensaje del último error
+        """
+        # Solo se restaura el estado si el usuario no ha iniciado ya otro modo
+        if self.status_label.cget('text') == "Estado: Conectando con la API...":
+            self.status_label.config(text="Estado: Esperando acción...")
+        
+        if error is not None:
+            messagebox.showwarning("Advertencia", f"No se pudo conectar con la API en {self.api_base_url}\n\nEl servidor puede estar iniciando. Intenta nuevamente en unos segundos.\n\nError: {error}")
     
     def setup_ui(self):
         # Control buttons (always visible at top)
@@ -266,11 +352,12 @@ class FaceRecognitionApp:
             return
         
         self.current_mode = 'login'
-        self.detection_count = {}
-        self.last_detection_time = {}
+        self.recent_detections.clear()
         self.access_granted = False  # Reset access granted flag
         self.processing_request = False  # Reset processing flag
         self.last_request_time = 0  # Reset last request time
+        self.last_recognition_status = None
+        self.negative_hashes.clear()
         self.status_label.config(text="Modo: LOGIN - Detectando rostro...", fg='#2196F3')
         threshold_percent = int(self.threshold * 100)
         self.info_label.config(text=f"Usuarios registrados: {len(registered_users)} | Umbral mínimo: {threshold_percent}%")
@@ -320,14 +407,31 @@ class FaceRecognitionApp:
     
     def start_camera(self):
         try:
-            self.camera = cv2.VideoCapture(0)
+            # Backend nativo explícito (DirectShow en Windows, V4L2 en Linux); si falla, el de por defecto
+            if sys.platform.startswith('win'):
+                backend = cv2.CAP_DSHOW
+            elif sys.platform.startswith('linux'):
+                backend = cv2.CAP_V4L2
+            else:
+                backend = cv2.CAP_ANY
+            self.camera = cv2.VideoCapture(0, backend)
+            if not self.camera.isOpened() and backend != cv2.CAP_ANY:
+                self.camera = cv2.VideoCapture(0)
             
             if not self.camera.isOpened():
                 messagebox.showerror("Error", "No se pudo abrir la cámara.")
                 return
             
+            # MJPG: la cámara entrega frames comprimidos (menos ancho de banda USB y decodificación más
+            # barata que YUYV -> BGR). Se pide antes de la resolución; si no lo soporta se ignora
+            self.camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
             self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
             self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+            # Pedir 30 fps explícitamente: algunos drivers eligen por defecto un modo más lento
+            self.camera.set(cv2.CAP_PROP_FPS, 30)
+            # Cola del driver de 1 frame: si el hilo de captura se retrasa, read() devuelve el frame más
+            # reciente en lugar de uno encolado hace varios periodos (V4L2/DirectShow; otros backends lo ignoran)
+            self.camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
             
             self.is_camera_active = True
             self.register_btn.config(state=DISABLED)
@@ -340,8 +444,15 @@ class FaceRecognitionApp:
                 # Hide button completely in login mode (automatic recognition)
                 self.capture_btn.pack_forget()
             
+            with self.frame_lock:
+                self.latest_frame = None
+                self.frame_ready.clear()
+            self.grabber_thread = threading.Thread(target=self._grabber_loop, args=(self.camera,), daemon=True)
+            self.grabber_thread.start()
             self.video_thread = threading.Thread(target=self.update_video, daemon=True)
             self.video_thread.start()
+            if self.display_after_id is None:
+                self.display_after_id = self.root.after(0, self._display_tick)
             
         except Exception as e:
             messagebox.showerror("Error", f"Error al iniciar la cámara: {str(e)}")
@@ -357,8 +468,7 @@ class FaceRecognitionApp:
         self.current_user_id = None
         self.last_frame = None
         self.access_granted = False
-        self.detection_count = {}
-        self.last_detection_time = {}
+        self.recent_detections.clear()
         self.processing_request = False  # Reset processing flag
         self.last_request_time = 0  # Reset last request time
         
@@ -387,6 +497,9 @@ class FaceRecognitionApp:
         # Stop camera if active
         self.stop_camera()
         
+        # Cerrar las conexiones persistentes con la API
+        self.http.close()
+        
         print("[INFO] Cerrando ventana GUI...")
         print("[INFO] Deteniendo servidor API...")
         print("=" * 60 + "\n")
@@ -408,6 +521,18 @@ class FaceRecognitionApp:
             self.camera.release()
             self.camera = None
         
+        # Detener el refresco de la vista previa y descartar el frame pendiente
+        if self.display_after_id is not None:
+            try:
+                self.root.after_cancel(self.display_after_id)
+            except Exception:
+                pass
+            self.display_after_id = None
+        try:
+            self.display_queue.get_nowait()
+        except queue.Empty:
+            pass
+        
         # Solo actualizar widgets si tkinter aún está disponible
         try:
             if hasattr(self, 'root') and self.root and self.root.winfo_exists():
@@ -433,11 +558,53 @@ class FaceRecognitionApp:
         self.last_frame = None
         self.access_granted = False  # Reset access granted flag
     
+    def _grabber_loop(self, camera):
+        """
+        Hilo lector: llama a camera.read() en bucle y publica cada frame en latest_frame.
+        read() bloquea esperando al driver; al hacerlo en su propio hilo la espera se solapa
+        con el procesamiento de update_video.
+        
+        Triple buffer sin copias: el lector escribe en su buffer trasero y lo intercambia con
+        latest_frame; update_video intercambia latest_frame con el buffer que acaba de procesar.
+        El buffer que está procesando nunca lo sobrescribe el lector; en modo registro update_video
+        retira el procesado de la rotación como last_frame y devuelve en su lugar el last_frame anterior.
+        
+        Args:
+            camera: cv2.VideoCapture abierto en start_camera
+        """
+        back = None
+        while self.is_camera_active and camera is self.camera:
+            ret, frame = camera.read(back)
+            if not ret:
+                break
+            with self.frame_lock:
+                # read() devuelve el buffer recibido (o uno nuevo en el primer frame / si cambia el tamaño)
+                back, self.latest_frame = self.latest_frame, frame
+                self.frame_ready.set()
+        # Despertar a update_video para que vea que el lector terminó
+        self.frame_ready.set()
+    
     def update_video(self):
+        grabber_thread = self.grabber_thread
+        frame = None
+        # Buffers de salida del resize preasignados (sin una asignación de 800x600x3 por frame). Son tres
+        # porque el frame mostrado y el que espera en display_queue todavía se leen desde el hilo de Tk
+        display_buffers = [np.empty((600, 800, 3), dtype=np.uint8) for _ in range(3)]
+        display_index = 0
+        
         while self.is_camera_active:
-            ret, frame = self.camera.read()
-            if not ret:
+            # Esperar a un frame nuevo; si el lector terminó (cámara desconectada) no llegará ninguno más
+            if not self.frame_ready.wait(timeout=0.5):
+                if grabber_thread is None or not grabber_thread.is_alive():
+                    break
+                continue
+            with self.frame_lock:
+                self.frame_ready.clear()
+                # Tomar el frame más reciente y devolver el ya procesado al lector para que lo reutilice
+                frame, self.latest_frame = self.latest_frame, frame
+            if frame is None:
                 break
+            self.frame_index += 1
             
             if self.current_mode == 'register':
                 processed_frame = self.process_register_frame(frame)
@@ -446,40 +613,80 @@ class FaceRecognitionApp:
             else:
                 processed_frame = frame
             
-            self.last_frame = processed_frame.copy()
-            
-            frame_rgb = cv2.cvtColor(processed_frame, cv2.COLOR_BGR2RGB)
-            frame_resized = cv2.resize(frame_rgb, (800, 600))
+            if self.current_mode == 'register':
+                # El frame procesado sale de la rotación como last_frame y el last_frame anterior ocupa su
+                # lugar (se devuelve al lector en el próximo intercambio): sin copias por frame. Bajo
+                # frame_lock, porque capture_face copia last_frame con el mismo lock
+                with self.frame_lock:
+                    frame, self.last_frame = self.last_frame, processed_frame
             
-            img = Image.fromarray(frame_resized)
-            imgtk = ImageTk.PhotoImage(image=img)
+            # Redimensionar en BGR y dejar que PIL invierta los canales al copiar el buffer
+            # (rawmode 'BGR'): se evita una pasada completa de cv2.cvtColor por frame
+            frame_resized = cv2.resize(processed_frame, (800, 600), dst=display_buffers[display_index],
+                                       interpolation=cv2.INTER_LINEAR)
+            display_index = (display_index + 1) % len(display_buffers)
             
-            self.video_label.config(image=imgtk, text="")
-            self.video_label.image = imgtk
+            img = Image.frombuffer('RGB', (800, 600), frame_resized, 'raw', 'BGR', 0, 1)
             
-            time.sleep(0.03)
+            # Publicar solo el frame más reciente: si el anterior no se mostró todavía, se descarta
+            try:
+                self.display_queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.display_queue.put_nowait(img)
+    
+    def _display_tick(self):
+        """
+        Muestra el último frame capturado (se ejecuta en el hilo de Tk cada display_interval_ms)
+        """
+        if not self.is_camera_active:
+            self.display_after_id = None
+            return
+        
+        try:
+            img = self.display_queue.get_nowait()
+        except queue.Empty:
+            img = None
+        
+        if img is not None:
+            # El PhotoImage se crea una sola vez (en el hilo de Tk) y se actualiza en el sitio con paste()
+            if self.preview_photo is None:
+                self.preview_photo = ImageTk.PhotoImage('RGB', (800, 600))
+            self.preview_photo.paste(img)
+            # Solo se reconfigura el label si muestra otra imagen (p. ej. tras stop_camera)
+            if self.video_label.cget('image') != str(self.preview_photo):
+                self.video_label.config(image=self.preview_photo, text="")
+                self.video_label.image = self.preview_photo
+        
+        self.display_after_id = self.root.after(self.display_interval_ms, self._display_tick)
     
     def draw_face_guide_region(self, frame):
         """
         Dibuja una región guía en el frame donde el usuario debe posicionar su rostro.
         Esto ayuda al usuario a saber dónde debe estar su rostro para mejor reconocimiento.
         """
-        height, width = frame.shape[:2]
-        
-        # Calcular coordenadas de la región de interés (ROI)
-        roi_x = int(width * (self.face_roi_center_x - self.face_roi_width_ratio / 2))
-        roi_y = int(height * (self.face_roi_center_y - self.face_roi_height_ratio / 2))
-        roi_width = int(width * self.face_roi_width_ratio)
-        roi_height = int(height * self.face_roi_height_ratio)
+        # Coordenadas de la región de interés (ROI), calculadas una vez por tamaño de frame
+        roi_x, roi_y, roi_width, roi_height = self._get_roi_rect(frame)
         
         # Dibujar rectángulo guía (verde si está dentro, amarillo si no)
         color = (0, 255, 0)  # Verde por defecto
         
-        # Verificar si hay rostro en esa región
-        roi_frame = frame[roi_y:roi_y+roi_height, roi_x:roi_x+roi_width]
-        has_face_in_roi = self._check_face_in_roi(roi_frame)
+        # Verificar si hay rostro en esa región. La detección Haar es la etapa más cara del hilo de captura:
+        # entre detecciones se reutiliza el último resultado (como mucho roi_check_interval de antigüedad)
+        now = time.time()
+        if now - self.last_roi_check_time >= self.roi_check_interval:
+            roi_frame = frame[roi_y:roi_y+roi_height, roi_x:roi_x+roi_width]
+            if self.face_cascade is not None and roi_frame.size > 0:
+                # Guardar la ROI en gris (para el hash de _roi_hash sobre este mismo frame) y el resultado
+                # (para process_login_frame): ninguno de los dos vuelve a convertir ni a detectar
+                self.roi_gray, scale = self._reduce_roi_gray(roi_frame)
+                self.roi_gray_index = self.frame_index
+                self.roi_has_face = self._detect_face_in_gray(self.roi_gray, scale)
+            else:
+                self.roi_has_face = False
+            self.last_roi_check_time = now
         
-        if not has_face_in_roi:
+        if not self.roi_has_face:
             color = (0, 165, 255)  # Naranja si no hay rostro en la región
         
         # Dibujar rectángulo externo
@@ -504,24 +711,70 @@ class FaceRecognitionApp:
         
         return roi_x, roi_y, roi_width, roi_height
     
-    def _check_face_in_roi(self, roi_frame) -> bool:
+    def _get_roi_rect(self, frame):
         """
-        Verifica si hay un rostro en la región de interés recortada.
+        Coordenadas enteras de la región guía para el tamaño del frame.
+        El tamaño no cambia mientras la cámara está abierta, así que se calculan una sola vez
+        y se reutilizan en cada frame (dibujo, detección, hash, reconocimiento y registro).
+        
+        Returns:
+            Tupla (roi_x, roi_y, roi_width, roi_height) dentro de los límites del frame
         """
-        if self.face_cascade is None or roi_frame.size == 0:
-            return False
+        height, width = frame.shape[:2]
+        cached = self.roi_rect
+        if cached is not None and cached[0] == width and cached[1] == height:
+            return cached[2]
+        
+        roi_x = int(width * (self.face_roi_center_x - self.face_roi_width_ratio / 2))
+        roi_y = int(height * (self.face_roi_center_y - self.face_roi_height_ratio / 2))
+        roi_width = int(width * self.face_roi_width_ratio)
+        roi_height = int(height * self.face_roi_height_ratio)
+        
+        # Asegurar que las coordenadas estén dentro del frame
+        roi_x = max(0, roi_x)
+        roi_y = max(0, roi_y)
+        roi_width = min(roi_width, width - roi_x)
+        roi_height = min(roi_height, height - roi_y)
+        
+        rect = (roi_x, roi_y, roi_width, roi_height)
+        # Una sola asignación de tupla: el hilo de captura y el de Tk pueden leerla sin lock
+        self.roi_rect = (width, height, rect)
+        return rect
+    
+    def _reduce_roi_gray(self, roi_frame):
+        """
+        Convierte la ROI a gris y la reduce a un lado máximo de roi_check_max_side px.
+        
+        Returns:
+            Tupla (ROI en gris reducida, factor de escala aplicado)
+        """
+        if len(roi_frame.shape) == 3:
+            gray = cv2.cvtColor(roi_frame, cv2.COLOR_BGR2GRAY)
+        else:
+            gray = roi_frame
         
+        # Solo se necesita saber si hay rostro (no sus coordenadas): reducir la ROI a un lado máximo
+        # de roi_check_max_side px deja 4-9 veces menos ventanas que evaluar
+        scale = self.roi_check_max_side / max(gray.shape[:2])
+        if scale < 1:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        else:
+            scale = 1.0
+        return gray, scale
+    
+    def _detect_face_in_gray(self, gray, scale) -> bool:
+        """
+        Ejecuta el clasificador sobre una ROI ya convertida y reducida por _reduce_roi_gray.
+        """
         try:
-            if len(roi_frame.shape) == 3:
-                gray = cv2.cvtColor(roi_frame, cv2.COLOR_BGR2GRAY)
-            else:
-                gray = roi_frame
+            min_side = max(15, int(30 * scale))
             
+            # scaleFactor 1.2: la mitad de niveles de pirámide que 1.1
             faces = self.face_cascade.detectMultiScale(
                 gray,
-                scaleFactor=1.1,
+                scaleFactor=1.2,
                 minNeighbors=3,
-                minSize=(30, 30)
+                minSize=(min_side, min_side)
             )
             return len(faces) > 0
         except Exception as e:
@@ -534,19 +787,8 @@ class FaceRecognitionApp:
         
         Esto asegura que siempre procesemos solo el rostro, eliminando el fondo variable.
         """
-        height, width = frame.shape[:2]
-        
-        # Calcular coordenadas de la región de interés
-        roi_x = int(width * (self.face_roi_center_x - self.face_roi_width_ratio / 2))
-        roi_y = int(height * (self.face_roi_center_y - self.face_roi_height_ratio / 2))
-        roi_width = int(width * self.face_roi_width_ratio)
-        roi_height = int(height * self.face_roi_height_ratio)
-        
-        # Asegurar que las coordenadas estén dentro del frame
-        roi_x = max(0, roi_x)
-        roi_y = max(0, roi_y)
-        roi_width = min(roi_width, width - roi_x)
-        roi_height = min(roi_height, height - roi_y)
+        # Coordenadas de la región de interés (ya ajustadas a los límites del frame)
+        roi_x, roi_y, roi_width, roi_height = self._get_roi_rect(frame)
         
         # Recortar la región de interés
         roi_frame = frame[roi_y:roi_y+roi_height, roi_x:roi_x+roi_width].copy()
@@ -558,12 +800,7 @@ class FaceRecognitionApp:
         if self.face_cascade is None:
             # Si no hay clasificador, devolver la ROI completa
             # Asegurar tamaño mínimo para DeepFace
-            min_size = 224
-            if roi_frame.shape[0] < min_size or roi_frame.shape[1] < min_size:
-                scale = min_size / min(roi_frame.shape[0], roi_frame.shape[1])
-                new_width = int(roi_frame.shape[1] * scale)
-                new_height = int(roi_frame.shape[0] * scale)
-                roi_frame = cv2.resize(roi_frame, (new_width, new_height), interpolation=cv2.INTER_CUBIC)
+            roi_frame = self._ensure_min_size(roi_frame, 224)
             return roi_frame
         
         try:
@@ -579,12 +816,7 @@ class FaceRecognitionApp:
                 # Si no se detecta rostro con Haar Cascade, devolver la ROI completa
                 # DeepFace (RetinaFace) es más robusto y puede detectarlo mejor
                 # Redimensionar si es muy pequeña
-                min_size = 224
-                if roi_frame.shape[0] < min_size or roi_frame.shape[1] < min_size:
-                    scale = min_size / min(roi_frame.shape[0], roi_frame.shape[1])
-                    new_width = int(roi_frame.shape[1] * scale)
-                    new_height = int(roi_frame.shape[0] * scale)
-                    roi_frame = cv2.resize(roi_frame, (new_width, new_height), interpolation=cv2.INTER_CUBIC)
+                roi_frame = self._ensure_min_size(roi_frame, 224)
                 return roi_frame
             
             # Tomar el rostro más grande (probablemente el más cercano)
@@ -603,12 +835,7 @@ class FaceRecognitionApp:
             face_crop = roi_frame[y:y+h, x:x+w]
             
             # Asegurar tamaño mínimo adecuado para DeepFace (mínimo 224x224 para mejor detección)
-            min_size = 224
-            if face_crop.shape[0] < min_size or face_crop.shape[1] < min_size:
-                scale = min_size / min(face_crop.shape[0], face_crop.shape[1])
-                new_width = int(face_crop.shape[1] * scale)
-                new_height = int(face_crop.shape[0] * scale)
-                face_crop = cv2.resize(face_crop, (new_width, new_height), interpolation=cv2.INTER_CUBIC)
+            face_crop = self._ensure_min_size(face_crop, 224)
             
             return face_crop
             
@@ -616,47 +843,46 @@ class FaceRecognitionApp:
             print(f"[DEBUG] Error al extraer rostro de ROI: {e}")
             # En caso de error, devolver la ROI completa (DeepFace lo intentará detectar)
             # Asegurar tamaño mínimo
-            min_size = 224
-            if roi_frame.shape[0] < min_size or roi_frame.shape[1] < min_size:
-                scale = min_size / min(roi_frame.shape[0], roi_frame.shape[1])
-                new_width = int(roi_frame.shape[1] * scale)
-                new_height = int(roi_frame.shape[0] * scale)
-                roi_frame = cv2.resize(roi_frame, (new_width, new_height), interpolation=cv2.INTER_CUBIC)
+            roi_frame = self._ensure_min_size(roi_frame, 224)
             return roi_frame
     
-    def has_face_in_frame(self, frame) -> bool:
+    def _ensure_min_size(self, image, min_size, interpolation=cv2.INTER_LINEAR):
+        """
+        Amplía la imagen (manteniendo la proporción) si alguno de sus lados es menor que min_size.
+        Si ya es suficientemente grande se devuelve sin tocar.
+        
+        Args:
+            image: Imagen BGR
+            min_size: Lado mínimo en píxeles
+            interpolation: INTER_LINEAR por defecto; DeepFace vuelve a redimensionar al tamaño del
+                modelo, así que la interpolación cúbica (unas 4 veces más cara) no aporta precisión
+        
+        Returns:
+            La imagen original o la versión ampliada
         """
-        Detección previa local usando OpenCV para verificar si hay un rostro en el frame.
-        Esto evita enviar frames sin rostro al servidor, ahorrando requests innecesarios.
-        Ahora verifica solo la región de interés (ROI) guía.
+        if image.shape[0] >= min_size and image.shape[1] >= min_size:
+            return image
+        scale = min_size / min(image.shape[0], image.shape[1])
+        new_width = int(image.shape[1] * scale)
+        new_height = int(image.shape[0] * scale)
+        return cv2.resize(image, (new_width, new_height), interpolation=interpolation)
+    
+    def _limit_max_size(self, image, max_side):
         """
-        if self.face_cascade is None:
-            # Si no hay clasificador, retornar True para no bloquear el flujo
-            return True
+        Reduce la imagen (manteniendo la proporción) si su lado mayor supera max_side.
+        Si ya es suficientemente pequeña se devuelve sin tocar.
         
-        try:
-            # Verificar solo en la región de interés
-            height, width = frame.shape[:2]
-            roi_x = int(width * (self.face_roi_center_x - self.face_roi_width_ratio / 2))
-            roi_y = int(height * (self.face_roi_center_y - self.face_roi_height_ratio / 2))
-            roi_width = int(width * self.face_roi_width_ratio)
-            roi_height = int(height * self.face_roi_height_ratio)
-            
-            # Asegurar coordenadas válidas
-            roi_x = max(0, roi_x)
-            roi_y = max(0, roi_y)
-            roi_width = min(roi_width, width - roi_x)
-            roi_height = min(roi_height, height - roi_y)
-            
-            roi_frame = frame[roi_y:roi_y+roi_height, roi_x:roi_x+roi_width]
-            
-            if roi_frame.size == 0:
-                return False
-            
-            return self._check_face_in_roi(roi_frame)
-        except Exception as e:
-            print(f"[DEBUG] Error en detección previa local: {e}")
-            return True  # En caso de error, permitir el flujo normal
+        Args:
+            image: Imagen BGR
+            max_side: Lado máximo en píxeles
+        
+        Returns:
+            La imagen original o la versión reducida
+        """
+        scale = max_side / max(image.shape[0], image.shape[1])
+        if scale >= 1:
+            return image
+        return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
     
     def process_register_frame(self, frame):
         # Dibujar región guía donde debe posicionarse el rostro
@@ -678,7 +904,7 @@ class FaceRecognitionApp:
         - Procesamiento asíncrono (no bloquea el thread del video)
         """
         # Dibujar región guía donde debe posicionarse el rostro (siempre visible)
-        self.draw_face_guide_region(frame)
+        roi = self.draw_face_guide_region(frame)
         
         # Early exit: Si ya se concedió acceso, no seguir procesando
         if self.access_granted:
@@ -691,8 +917,9 @@ class FaceRecognitionApp:
         time_since_last_request = current_time - self.last_request_time
         
         if time_since_last_request < self.request_interval:
-            # Aún no ha pasado el tiempo mínimo, mostrar mensaje de espera
-            cv2.putText(frame, f"Analizando... ({int((self.request_interval - time_since_last_request) * 10) / 10}s)", 
+            # Aún no ha pasado el tiempo mínimo: reutilizar el último resultado para el overlay
+            status = self.last_recognition_status or f"Analizando... ({int((self.request_interval - time_since_last_request) * 10) / 10}s)"
+            cv2.putText(frame, status, 
                        (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
             return frame
         
@@ -703,50 +930,137 @@ class FaceRecognitionApp:
             return frame
         
         # Detección previa local: Solo enviar si hay un rostro visible en la región guía
-        if not self.has_face_in_frame(frame):
+        # (reutiliza la detección que draw_face_guide_region ya hizo sobre este frame)
+        if self.face_cascade is not None and not self.roi_has_face:
             cv2.putText(frame, "Posiciona tu rostro dentro del recuadro", 
                        (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 165, 255), 2)
             return frame
         
+        # Filtro barato antes de la API: una ROI oscura o uniforme no puede contener un rostro reconocible
+        roi_gray = self._current_roi_gray(frame, roi)
+        if cv2.meanStdDev(roi_gray)[1][0][0] < self.roi_min_stddev:
+            self.last_request_time = current_time
+            cv2.putText(frame, "Iluminacion insuficiente en el recuadro", 
+                       (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 165, 255), 2)
+            return frame
+        
+        # Si el frame es casi idéntico a uno que ya no se reconoció, reutilizar ese resultado
+        frame_hash = self._roi_hash(roi_gray)
+        if self._is_known_negative(frame_hash, current_time):
+            self.last_request_time = current_time
+            cv2.putText(frame, self.last_recognition_status or "Rostro no reconocido, reintentando...", 
+                       (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
+            return frame
+        
         # Todas las verificaciones pasaron: Procesar frame de forma asíncrona
         self.processing_request = True
         self.last_request_time = current_time
         
+        # Encolar para el worker de reconocimiento (no bloquea el thread del video)
+        self._submit_recognition(frame.copy(), frame_hash)
+        
         # Mostrar mensaje en frame mientras procesa
         cv2.putText(frame, "Verificando identidad...", 
                    (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
         
-        # Procesar en thread separado para no bloquear el video
-        def recognize_in_thread():
+        return frame
+    
+    def _current_roi_gray(self, frame, roi):
+        """
+        ROI del frame actual en gris y reducida (_reduce_roi_gray). Reutiliza la de
+        draw_face_guide_region si se calculó sobre este mismo frame.
+        """
+        if self.roi_gray_index == self.frame_index:
+            return self.roi_gray
+        roi_x, roi_y, roi_width, roi_height = roi
+        roi_frame = frame[max(0, roi_y):roi_y+roi_height, max(0, roi_x):roi_x+roi_width]
+        gray, _ = self._reduce_roi_gray(roi_frame)
+        return gray
+    
+    def _roi_hash(self, gray) -> int:
+        """
+        Hash perceptual de 64 bits (average hash 8x8 en gris) de la región guía.
+        Se calcula siempre sobre la ROI reducida de _current_roi_gray, para que los hashes sean comparables.
+        """
+        small = cv2.resize(gray, (8, 8), interpolation=cv2.INTER_AREA)
+        return int.from_bytes(np.packbits(small > small.mean()).tobytes(), 'big')
+    
+    def _is_known_negative(self, frame_hash, now) -> bool:
+        """
+        True si el hash está a distancia de Hamming <= hash_max_distance de un frame
+        rechazado hace menos de negative_hash_ttl segundos.
+        """
+        for known_hash, timestamp in list(self.negative_hashes.items()):
+            if now - timestamp > self.negative_hash_ttl:
+                del self.negative_hashes[known_hash]
+            elif bin(known_hash ^ frame_hash).count('1') <= self.hash_max_distance:
+                return True
+        return False
+    
+    def _remember_negative(self, frame_hash):
+        """Guarda el hash de un frame que no se reconoció (LRU acotado)"""
+        self.negative_hashes[frame_hash] = time.time()
+        self.negative_hashes.move_to_end(frame_hash)
+        while len(self.negative_hashes) > self.negative_hashes_maxlen:
+            self.negative_hashes.popitem(last=False)
+    
+    def _submit_recognition(self, frame, frame_hash=None):
+        """
+        Encola un frame para reconocimiento. Si ya hay uno pendiente, se descarta
+        y se reemplaza por el nuevo: siempre se procesa el frame más reciente.
+        """
+        try:
+            self.recognition_queue.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            self.recognition_queue.put_nowait((frame, frame_hash))
+        except queue.Full:
+            pass
+    
+    def _recognition_worker(self):
+        """
+        Thread persistente que consume frames de la cola y llama a la API.
+        El resultado se entrega al thread principal con root.after.
+        """
+        while True:
+            frame, frame_hash = self.recognition_queue.get()
             try:
-                detected_user = self.detect_and_recognize_face(frame.copy())
+                detected_user = self.detect_and_recognize_face(frame)
                 
                 # Actualizar UI en thread principal
-                self.root.after(0, lambda: self.handle_recognition_result(detected_user))
+                self.root.after(0, lambda u=detected_user, h=frame_hash: self.handle_recognition_result(u, h))
             except Exception as e:
                 print(f"[ERROR] Error en reconocimiento asíncrono: {e}")
-                import traceback
                 traceback.print_exc()
                 # Liberar flag en caso de error
-                self.root.after(0, lambda: setattr(self, 'processing_request', False))
-        
-        recognition_thread = threading.Thread(target=recognize_in_thread, daemon=True)
-        recognition_thread.start()
-        
-        return frame
+                try:
+                    self.root.after(0, lambda: setattr(self, 'processing_request', False))
+                except Exception:
+                    pass  # La ventana ya fue destruida
     
-    def handle_recognition_result(self, detected_user):
+    def handle_recognition_result(self, detected_user, frame_hash=None):
         """
         Maneja el resultado del reconocimiento en el thread principal.
         """
         self.processing_request = False  # Liberar flag siempre
         
+        if not detected_user:
+            self.last_recognition_status = "Rostro no reconocido, reintentando..."
+            self.recent_detections.clear()
+            if frame_hash is not None:
+                self._remember_negative(frame_hash)
+        
         if detected_user:
             user_id, similarity, other_similarities = detected_user
             
             print(f"[INFO] Usuario detectado: {user_id}, Similitud: {similarity:.2%}")
             
-            # Grant access immediately on first detection - stop camera and show alert
+            if not self._confirm_detection(user_id):
+                self.last_recognition_status = f"Confirmando identidad ({len(self.recent_detections)}/{self.detection_count_threshold})..."
+                return
+            
+            # Grant access once the detection is confirmed - stop camera and show alert
             if not self.access_granted:
                 print(f"[INFO] Concediendo acceso a usuario: {user_id}")
                 self.access_granted = True
@@ -758,52 +1072,50 @@ class FaceRecognitionApp:
                 # Show alert immediately (use after_idle to ensure it runs in main thread)
                 self.root.after_idle(lambda u=user_id, s=similarity, o=other_similarities: self.grant_access(u, s, o))
     
+    def _confirm_detection(self, user_id) -> bool:
+        """
+        Registra una detección y devuelve True si las últimas detection_count_threshold
+        son del mismo usuario y caben en detection_window segundos.
+        """
+        now = time.time()
+        self.recent_detections.append((user_id, now))
+        
+        if len(self.recent_detections) < self.detection_count_threshold:
+            return False
+        
+        oldest_user, oldest_time = self.recent_detections[0]
+        return (now - oldest_time <= self.detection_window
+                and all(uid == user_id for uid, _ in self.recent_detections))
+    
     def detect_and_recognize_face(self, frame) -> Optional[Tuple[str, float, list]]:
-        temp_file = None
         try:
             # IMPORTANTE: Enviar toda la ROI (región guía) para consistencia con el registro
             # Esto da más contexto a DeepFace y mejora la detección
-            height, width = frame.shape[:2]
-            roi_x = int(width * (self.face_roi_center_x - self.face_roi_width_ratio / 2))
-            roi_y = int(height * (self.face_roi_center_y - self.face_roi_height_ratio / 2))
-            roi_width = int(width * self.face_roi_width_ratio)
-            roi_height = int(height * self.face_roi_height_ratio)
+            roi_x, roi_y, roi_width, roi_height = self._get_roi_rect(frame)
             
-            # Asegurar coordenadas válidas
-            roi_x = max(0, roi_x)
-            roi_y = max(0, roi_y)
-            roi_width = min(roi_width, width - roi_x)
-            roi_height = min(roi_height, height - roi_y)
-            
-            # Extraer toda la región de interés (con contexto completo)
-            roi_image = frame[roi_y:roi_y+roi_height, roi_x:roi_x+roi_width].copy()
+            # Extraer toda la región de interés (con contexto completo). Es una vista sin copia:
+            # el frame ya es una copia privada del worker y resize/imencode no lo modifican
+            roi_image = frame[roi_y:roi_y+roi_height, roi_x:roi_x+roi_width]
             
             if roi_image.size == 0:
                 print("[DEBUG] ROI vacía")
                 return None
             
-            # Asegurar tamaño mínimo para DeepFace
-            min_size = 300
-            if roi_image.shape[0] < min_size or roi_image.shape[1] < min_size:
-                scale = min_size / min(roi_image.shape[0], roi_image.shape[1])
-                new_width = int(roi_image.shape[1] * scale)
-                new_height = int(roi_image.shape[0] * scale)
-                roi_image = cv2.resize(roi_image, (new_width, new_height), interpolation=cv2.INTER_CUBIC)
-            
-            # Save temp file con alta calidad
-            temp_dir = Path("temp_images")
-            temp_dir.mkdir(exist_ok=True)
-            unique_id = str(uuid.uuid4())
-            temp_file = str(temp_dir / f"temp_verify_{unique_id}.jpg")
-            cv2.imwrite(temp_file, roi_image, [cv2.IMWRITE_JPEG_QUALITY, 95])
+            # Asegurar tamaño mínimo para DeepFace y no enviar más píxeles de los que el servidor usa
+            roi_image = self._limit_max_size(roi_image, self.upload_max_side)
+            roi_image = self._ensure_min_size(roi_image, 300)
             
-            with open(temp_file, 'rb') as f:
-                files = {'file': ('frame.jpg', f, 'image/jpeg')}
-                # Increased timeout to 5 seconds for face detection processing
-                response = requests.post(f"{self.api_base_url}/verify-frame", files=files, timeout=5)
+            # Codificar JPEG en memoria (sin archivo temporal en cada frame)
+            ok, buffer = cv2.imencode('.jpg', roi_image, [cv2.IMWRITE_JPEG_QUALITY, self.verify_jpeg_quality])
+            if not ok:
+                print("[DEBUG] No se pudo codificar la ROI")
+                return None
             
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
+            files = {'file': ('frame.jpg', buffer.tobytes(), 'image/jpeg')}
+            # Increased timeout to 5 seconds for face detection processing
+            # Solo se usan el mejor y los 3 siguientes: el servidor no ordena ni serializa el resto
+            response = self.http.post(f"{self.api_base_url}/verify-frame", files=files,
+                                     params={'top_k': 4}, timeout=5)
             
             if response.status_code != 200:
                 return None
@@ -823,12 +1135,12 @@ class FaceRecognitionApp:
             if similarity < threshold:
                 return None
             
-            print(f"[INFO] Usuario reconocido: {user_id}, similitud: {similarity:.2%}")
-            
-            other_similarities = []
-            for sim_data in data.get('other_similarities', []):
-                if sim_data['similarity'] >= 0.05:
-                    other_similarities.append((str(sim_data['user_id']), float(sim_data['similarity'])))
+            # El servidor ya devuelve solo los top_k ordenados; aquí se filtran una vez las similitudes despreciables
+            other_similarities = [
+                (str(sim_data['user_id']), float(sim_data['similarity']))
+                for sim_data in data.get('other_similarities', [])
+                if sim_data['similarity'] >= 0.05
+            ]
             
             return (user_id, similarity, other_similarities)
             
@@ -837,13 +1149,7 @@ class FaceRecognitionApp:
             return None
         except Exception as e:
             print(f"[ERROR] Error en detección: {e}")
-            import traceback
             traceback.print_exc()
-            if temp_file and os.path.exists(temp_file):
-                try:
-                    os.remove(temp_file)
-                except:
-                    pass
             return None
     
     def capture_face(self):
@@ -854,7 +1160,11 @@ class FaceRecognitionApp:
             messagebox.showwarning("Error", "No hay frame disponible. Espera un momento.")
             return
         
-        self.save_face(self.last_frame)
+        # update_video reemplaza last_frame en cada frame y devuelve el anterior al lector: se copia
+        # bajo frame_lock para que no se reemplace (y se reutilice) durante la copia
+        with self.frame_lock:
+            frame = self.last_frame.copy()
+        self.save_face(frame)
     
     def save_face(self, frame):
         if not self.is_camera_active or self.current_mode != 'register':
@@ -864,95 +1174,73 @@ class FaceRecognitionApp:
         self.capture_btn.config(state=DISABLED)
         self.status_label.config(text="Procesando rostro... Esto puede tomar hasta 2 minutos...", fg='#FF9800')
         self.info_label.config(text="Extrayendo características faciales y guardando en base de datos...")
-        self.root.update()
+        self.root.update_idletasks()  # Solo redibujar las etiquetas (sin procesar eventos de entrada)
         
         # SOLUCIÓN: Enviar toda la ROI (región guía) en lugar de recortar solo el rostro
         # Esto da más contexto a DeepFace y mejora significativamente la detección
         # DeepFace puede detectar y recortar el rostro automáticamente, pero necesita contexto suficiente
         
-        height, width = frame.shape[:2]
-        roi_x = int(width * (self.face_roi_center_x - self.face_roi_width_ratio / 2))
-        roi_y = int(height * (self.face_roi_center_y - self.face_roi_height_ratio / 2))
-        roi_width = int(width * self.face_roi_width_ratio)
-        roi_height = int(height * self.face_roi_height_ratio)
-        
-        # Asegurar coordenadas válidas
-        roi_x = max(0, roi_x)
-        roi_y = max(0, roi_y)
-        roi_width = min(roi_width, width - roi_x)
-        roi_height = min(roi_height, height - roi_y)
+        roi_x, roi_y, roi_width, roi_height = self._get_roi_rect(frame)
         
-        # Extraer toda la región de interés (con contexto completo)
-        roi_image = frame[roi_y:roi_y+roi_height, roi_x:roi_x+roi_width].copy()
+        # Extraer toda la región de interés (con contexto completo). Vista sin copia: capture_face ya
+        # entrega una copia privada del frame y resize/imencode no modifican su entrada
+        roi_image = frame[roi_y:roi_y+roi_height, roi_x:roi_x+roi_width]
         
         if roi_image.size == 0:
             messagebox.showerror("Error", "No se pudo extraer la región de interés. Por favor, intenta nuevamente.")
             self.capture_btn.config(state=NORMAL)
             return
         
-        # Verificar que hay un rostro en la ROI usando detección local (opcional, solo para feedback)
-        if not self.has_face_in_frame(frame):
-            messagebox.showwarning("Advertencia", "No se detectó rostro en la región guía. Se enviará de todas formas, pero asegúrate de posicionar tu rostro correctamente.")
+        # Verificar que hay un rostro en la ROI (opcional, solo para feedback). Se reutiliza la detección
+        # del hilo de captura (como mucho roi_check_interval de antigüedad) en lugar de ejecutar el
+        # clasificador otra vez en el hilo de Tk
+        face_seen = self.face_cascade is None or self.roi_has_face
         
         # Asegurar tamaño mínimo para DeepFace (mínimo 300x300 para mejor detección)
-        min_size = 300
-        if roi_image.shape[0] < min_size or roi_image.shape[1] < min_size:
-            scale = min_size / min(roi_image.shape[0], roi_image.shape[1])
-            new_width = int(roi_image.shape[1] * scale)
-            new_height = int(roi_image.shape[0] * scale)
-            roi_image = cv2.resize(roi_image, (new_width, new_height), interpolation=cv2.INTER_CUBIC)
-        
-        # Save temp file con calidad alta (95% de calidad JPEG para preservar detalles)
-        temp_dir = Path("temp_images")
-        temp_dir.mkdir(exist_ok=True)
-        unique_id = str(uuid.uuid4())
-        temp_file = str(temp_dir / f"temp_register_{unique_id}.jpg")
-        
-        # Guardar con alta calidad para preservar detalles faciales
-        cv2.imwrite(temp_file, roi_image, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        roi_image = self._limit_max_size(roi_image, self.upload_max_side)
+        roi_image = self._ensure_min_size(roi_image, 300, cv2.INTER_CUBIC)
         
         user_id = self.current_user_id
         if not user_id:
             messagebox.showerror("Error", "No se pudo obtener el ID de usuario")
             self.capture_btn.config(state=NORMAL)
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
             return
         
+        # Codificar en memoria con calidad alta (95% de calidad JPEG para preservar detalles faciales)
+        ok, buffer = cv2.imencode('.jpg', roi_image, [cv2.IMWRITE_JPEG_QUALITY, self.register_jpeg_quality])
+        if not ok:
+            messagebox.showerror("Error", "No se pudo codificar la imagen. Por favor, intenta nuevamente.")
+            self.capture_btn.config(state=NORMAL)
+            return
+        image_bytes = buffer.tobytes()
+        
         # Run registration in a separate thread to keep GUI responsive
         def register_in_thread():
             try:
-                with open(temp_file, 'rb') as f:
-                    files = {'file': ('face.jpg', f, 'image/jpeg')}
-                    data = {'user_id': user_id}
-                    # Increased timeout to 120 seconds (2 minutes) for DeepFace processing
-                    response = requests.post(f"{self.api_base_url}/register", files=files, data=data, timeout=120)
-                
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
+                files = {'file': ('face.jpg', image_bytes, 'image/jpeg')}
+                data = {'user_id': user_id}
+                # Increased timeout to 120 seconds (2 minutes) for DeepFace processing
+                response = self.http.post(f"{self.api_base_url}/register", files=files, data=data, timeout=120)
                 
                 # Update GUI in main thread
                 self.root.after(0, lambda: self.handle_register_response(response, user_id))
                 
             except requests.exceptions.Timeout:
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
                 self.root.after(0, lambda: self.handle_register_error(
                     "Tiempo de espera agotado. El proceso de registro puede tardar hasta 2 minutos. Por favor intenta nuevamente."
                 ))
             except Exception as e:
                 error_msg = str(e)
                 print(f"[ERROR] Error al registrar rostro: {error_msg}")
-                if os.path.exists(temp_file):
-                    try:
-                        os.remove(temp_file)
-                    except:
-                        pass
                 self.root.after(0, lambda: self.handle_register_error(f"Error al registrar rostro:\n{error_msg}"))
         
         # Start registration in background thread
         registration_thread = threading.Thread(target=register_in_thread, daemon=True)
         registration_thread.start()
+        
+        # El aviso se muestra con el envío ya en curso (no retrasa el registro)
+        if not face_seen:
+            messagebox.showwarning("Advertencia", "No se detectó rostro en la región guía. Se envió de todas formas, pero asegúrate de posicionar tu rostro correctamente.")
     
     def handle_register_response(self, response, user_id):
         """Handle registration response in main thread"""
@@ -961,6 +1249,8 @@ class FaceRecognitionApp:
         if response.status_code == 200:
             result = response.json()
             if result.get('success'):
+                # La lista de usuarios cambió: la próxima consulta vuelve a pedirla
+                self.users_cache = None
                 self.status_label.config(text=f"Usuario '{user_id}' registrado correctamente!", fg='#4CAF50')
                 self.info_label.config(text="")
                 messagebox.showinfo("Éxito", f"Usuario '{user_id}' registrado correctamente!")
@@ -1012,11 +1302,9 @@ class FaceRecognitionApp:
         
         if other_similarities and len(other_similarities) > 0:
             message += "Rostros similares detectados:\n"
-            max_others = min(3, len(other_similarities))
-            for i in range(max_others):
-                other_user, other_sim = other_similarities[i]
-                if other_sim >= 0.05:
-                    message += f"  • Usuario {other_user}: {other_sim:.2%}\n"
+            # Ya vienen ordenadas y filtradas (>= 5%) desde detect_and_recognize_face
+            for other_user, other_sim in other_similarities[:3]:
+                message += f"  • Usuario {other_user}: {other_sim:.2%}\n"
             message += "\n"
         
         message += "Bienvenido al sistema.\n\n"
@@ -1057,20 +1345,25 @@ class FaceRecognitionApp:
     def get_registered_users(self):
         """
         Obtiene la lista de usuarios registrados desde el microservicio externo NestJS
+        (la respuesta correcta se reutiliza durante users_cache_ttl segundos)
         """
+        if self.users_cache is not None and time.time() - self.users_cache[0] < self.users_cache_ttl:
+            return self.users_cache[1]
+        
         try:
             # Construct full URL
             users_url = f"{self.external_api_url}/users"
             print(f"[DEBUG] Intentando conectar a: {users_url}")
             
             # Call external NestJS microservice with increased timeout
-            response = requests.get(users_url, timeout=5)
+            response = self.http.get(users_url, timeout=5)
             
             if response.status_code == 200:
                 data = response.json()
                 # External service returns: { users: string[], count: number }
                 users = data.get('data', {}).get('users', [])
                 print(f"[DEBUG] Usuarios obtenidos exitosamente: {len(users)} usuarios")
+                self.users_cache = (time.time(), users)
                 return users
             else:
                 print(f"[WARN] Respuesta del servidor con código {response.status_code}: {response.text}")
@@ -6,7 +6,7 @@ import os
 import uuid
 import traceback
 from pathlib import Path
-from typing import Optional, Tuple, List
+from typing import Optional, Tuple, Union
 from datetime import datetime
 
 import cv2
@@ -15,11 +15,12 @@ from deepface import DeepFace
 from dotenv import load_dotenv
 
 from database import Database
-from embeddings_cache import get_all_embeddings_with_cache, clear_embeddings_cache
+from embeddings_cache import get_all_embeddings_with_cache, add_embedding_to_cache
 from exceptions import (
     FaceNotFoundError,
     DatabaseError,
     DuplicateUserError,
+    InvalidImageError,
     UserNotFoundError,
     ValidationError,
 )
@@ -28,6 +29,46 @@ from logger_config import logger
 # Load environment variables
 load_dotenv()
 
+# Lado máximo (px) de la imagen que se pasa al detector; las más grandes se reducen antes de procesar
+MAX_INPUT_SIDE = int(os.getenv('FACE_MAX_INPUT_SIDE', 640))
+
+# Modelo de embeddings de DeepFace (p. ej. 'ArcFace', 'SFace', 'Facenet'). Los modelos ligeros de 128 dimensiones
+# son varias veces más rápidos; cambiarlo invalida los embeddings ya registrados (hay que volver a registrar)
+FACE_MODEL = os.getenv('FACE_MODEL', 'ArcFace')
+
+# Filtro previo con Haar Cascade: descarta imágenes sin rostro antes de llamar a DeepFace (desactivado por defecto,
+# Haar pierde rostros de perfil o con poca luz que RetinaFace/MTCNN sí detectan)
+HAAR_GATE = os.getenv('FACE_HAAR_GATE', 'false').lower() == 'true'
+
+# Ancho (px) de la imagen en escala de grises sobre la que se ejecuta el filtro Haar
+HAAR_GATE_WIDTH = 320
+
+# Hilos intra-op de TensorFlow y de OpenCV por proceso (0 = valor por defecto de cada librería, un hilo por núcleo).
+# Con varios workers de uvicorn conviene limitarlo para no tener más hilos de cómputo que núcleos
+INFERENCE_THREADS = int(os.getenv('FACE_INFERENCE_THREADS', 0))
+
+
+def _limit_inference_threads(threads: int):
+    """
+    Limita los pools de hilos de TensorFlow y OpenCV (debe llamarse antes de construir el modelo)
+    
+    Args:
+        threads: Número máximo de hilos (0 o negativo = sin cambios)
+    """
+    if threads <= 0:
+        return
+    cv2.setNumThreads(threads)
+    try:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+    except (ImportError, RuntimeError) as e:
+        # RuntimeError: TensorFlow ya se inicializó y no admite cambiar sus pools
+        logger.warning(f"No se pudo limitar los hilos de TensorFlow: {e}")
+
+
+_limit_inference_threads(INFERENCE_THREADS)
+
+
 class FaceRecognitionSystem:
     """
     Sistema de reconocimiento facial usando DeepFace
@@ -82,22 +123,34 @@ class FaceRecognitionSystem:
                 "Instala 'retina-face' o 'mtcnn' para mejorar el reconocimiento."
             )
         
-        # Modelo: ArcFace ofrece la mejor precisión para verificación
-        # Si ArcFace no está disponible, usar VGG-Face (muy preciso también)
+        # Modelo: configurable con FACE_MODEL (por defecto ArcFace, la mejor precisión para verificación)
+        # Si el modelo no está disponible, usar VGG-Face (muy preciso también)
         try:
-            self.model_name = 'ArcFace'
-            # Verificar que esté disponible
-            test_result = DeepFace.build_model('ArcFace')
-            logger.info("ArcFace disponible - usando como modelo")
+            self.model_name = FACE_MODEL
+            # Verificar que esté disponible (DeepFace guarda la instancia construida y la reutiliza)
+            self.model = DeepFace.build_model(FACE_MODEL)
+            logger.info(f"{FACE_MODEL} disponible - usando como modelo")
         except Exception as e:
             self.model_name = 'VGG-Face'
-            logger.info(f"ArcFace no disponible, usando VGG-Face: {e}")
+            self.model = None
+            logger.info(f"{FACE_MODEL} no disponible, usando VGG-Face: {e}")
+        
+        # Clasificador Haar precargado una sola vez para el filtro previo (None si está desactivado)
+        self.face_cascade = None
+        if HAAR_GATE:
+            self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+            if self.face_cascade.empty():
+                logger.warning("No se pudo cargar el clasificador Haar, se desactiva el filtro previo")
+                self.face_cascade = None
         
         # Configuraciones adicionales para invarianza al fondo
         self.align_faces = True  # Alineación facial para corregir poses
         self.enforce_detection = True  # Exigir detección de rostro (más seguro)
         self.distance_metric = 'cosine'  # Métrica de similitud coseno (robusta)
         
+        if os.getenv('FACE_WARMUP', 'true').lower() == 'true':
+            self._warm_up()
+        
         if not Database.test_connection():
             print("[WARN] No se pudo conectar a la base de datos. Verifica la configuración en .env")
         else:
@@ -110,8 +163,29 @@ class FaceRecognitionSystem:
         print(f"[INFO] Alineación facial: {self.align_faces} (corrige poses y rotaciones)")
         print(f"[INFO] Detección obligatoria: {self.enforce_detection} (requiere rostro válido)")
         print(f"[INFO] Métrica de distancia: {self.distance_metric}")
+        print(f"[INFO] Filtro previo Haar: {self.face_cascade is not None}")
         print(f"[INFO] Directorio de imágenes: {self.registered_faces_dir.absolute()}")
     
+    def _warm_up(self):
+        """
+        Construye y ejecuta una vez el modelo y el detector al iniciar.
+        
+        DeepFace cachea las instancias construidas, pero el primer represent() carga los pesos
+        del detector y traza el grafo del modelo; hacerlo aquí evita que lo pague la primera petición.
+        """
+        try:
+            if self.model is None:
+                self.model = DeepFace.build_model(self.model_name)
+            DeepFace.represent(
+                img_path=np.zeros((224, 224, 3), dtype=np.uint8),
+                model_name=self.model_name,
+                detector_backend=self.backend,
+                enforce_detection=False
+            )
+            logger.bind(model=self.model_name, backend=self.backend).info("Modelo y detector precargados")
+        except Exception as e:
+            logger.warning(f"No se pudo precargar el modelo: {e}")
+    
     def _save_image_temp(self, image_bytes: bytes) -> Optional[str]:
         # Save image bytes to temporary file for processing
         """
@@ -146,66 +220,114 @@ class FaceRecognitionSystem:
             traceback.print_exc()
             return None
 
-    def _preprocess_image(self, image_path: str) -> Optional[str]:
+    def _decode_image(self, image_bytes: bytes) -> Optional[np.ndarray]:
+        """
+        Decodifica los bytes de una imagen a un array BGR en memoria (sin pasar por disco)
+        
+        Args:
+            image_bytes: Bytes de la imagen (JPEG, PNG, ...)
+            
+        Returns:
+            Imagen BGR uint8 o None si no se pudo decodificar
+        """
+        if not image_bytes:
+            return None
+        return cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def _has_face_haar(self, img: np.ndarray) -> bool:
+        """
+        Filtro previo barato: detecta rostros con Haar Cascade sobre una copia reducida en escala de grises
+        
+        Args:
+            img: Imagen BGR
+            
+        Returns:
+            True si hay al menos un rostro (o si el filtro está desactivado)
+        """
+        if self.face_cascade is None:
+            return True
+        
+        height, width = img.shape[:2]
+        scale = min(1.0, HAAR_GATE_WIDTH / width)
+        small = cv2.resize(img, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA) if scale < 1.0 else img
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        min_side = max(24, int(60 * scale))
+        faces = self.face_cascade.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=4, minSize=(min_side, min_side))
+        return len(faces) > 0
+
+    def _preprocess_image(self, img: np.ndarray) -> Optional[np.ndarray]:
         """
         Aplica normalización de iluminación y contraste para reducir variaciones de fondo.
-        Devuelve la ruta a la imagen temporal preprocesada o None si no se pudo procesar.
+        Devuelve la imagen preprocesada (BGR) o None si no se pudo procesar.
         """
         try:
-            img = cv2.imread(image_path)
-            if img is None:
-                return None
-
-            # Normalización de histograma (espacio YUV)
+            # Una sola conversión a YUV: ecualización global y CLAHE se aplican seguidas sobre el canal Y
+            # (antes se volvía a BGR entre ambas, dos pasadas completas de cvtColor extra)
             img_yuv = cv2.cvtColor(img, cv2.COLOR_BGR2YUV)
-            img_yuv[:, :, 0] = cv2.equalizeHist(img_yuv[:, :, 0])
-            img_norm = cv2.cvtColor(img_yuv, cv2.COLOR_YUV2BGR)
+            y = np.ascontiguousarray(img_yuv[:, :, 0])
+
+            # Normalización de histograma
+            cv2.equalizeHist(y, dst=y)
 
             # CLAHE para contraste local adaptativo
             clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-            img_yuv = cv2.cvtColor(img_norm, cv2.COLOR_BGR2YUV)
-            img_yuv[:, :, 0] = clahe.apply(img_yuv[:, :, 0])
-            img_processed = cv2.cvtColor(img_yuv, cv2.COLOR_YUV2BGR)
-
-            processed_path = f"{image_path}_preprocessed.jpg"
-            cv2.imwrite(processed_path, img_processed, [cv2.IMWRITE_JPEG_QUALITY, 95])
-
-            return processed_path
+            img_yuv[:, :, 0] = clahe.apply(y)
+            return cv2.cvtColor(img_yuv, cv2.COLOR_YUV2BGR)
         except Exception as e:
             logger.warning(f"No se pudo preprocesar la imagen para mejorar invarianza al fondo: {e}")
             return None
     
-    def _extract_face_embedding(self, image_path: str) -> Optional[np.ndarray]:
+    def _extract_face_embedding(self, image: Union[str, np.ndarray]) -> Optional[np.ndarray]:
         """
         Extrae el embedding facial de una imagen usando DeepFace con configuración optimizada.
         
         Configuración optimizada para reconocimiento robusto e invariante al fondo:
         - Detector robusto (RetinaFace/MTCNN) para localización precisa
         - Alineación facial para corregir poses y rotaciones
-        - Modelo de alta precisión (ArcFace/VGG-Face)
+        - Modelo configurable (ArcFace por defecto, VGG-Face como respaldo)
         - Detección obligatoria para seguridad
         
         Args:
-            image_path: Ruta a la imagen
+            image: Imagen BGR ya decodificada (se pasa a DeepFace sin escribirla a disco)
+                o ruta a un archivo de imagen
             
         Returns:
             Embedding facial normalizado o None si no se detecta rostro
         """
-        processed_path = None
         try:
-            # Verificar que el archivo existe
-            if not os.path.exists(image_path):
-                logger.error(f"Archivo de imagen no existe: {image_path}")
+            if isinstance(image, np.ndarray):
+                img = image
+            else:
+                # Verificar que el archivo existe
+                if not os.path.exists(image):
+                    logger.error(f"Archivo de imagen no existe: {image}")
+                    return None
+                img = cv2.imread(image)
+            
+            if img is None or img.size == 0:
+                logger.error("No se pudo decodificar la imagen")
                 return None
+            
+            # El modelo trabaja a 112-224 px: reducir imágenes grandes antes del preprocesado y
+            # la detección abarata ambos sin perder resolución útil del rostro
+            height, width = img.shape[:2]
+            if max(height, width) > MAX_INPUT_SIDE:
+                scale = MAX_INPUT_SIDE / max(height, width)
+                img = cv2.resize(img, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+            # Sin rostro visible para Haar no se llama a DeepFace (detector + modelo)
+            if not self._has_face_haar(img):
+                logger.debug("Filtro Haar: no se detectó rostro, se omite DeepFace")
+                raise FaceNotFoundError("No se detectó ningún rostro en la imagen")
 
-            processed_path = self._preprocess_image(image_path)
-            image_path_to_use = processed_path or image_path
+            processed = self._preprocess_image(img)
+            img_to_use = processed if processed is not None else img
             
             # Primer intento: usar imagen preprocesada (si existe)
             try:
                 embedding_obj = DeepFace.represent(
-                    img_path=image_path_to_use,
-                    model_name=self.model_name,  # ArcFace o VGG-Face (alta precisión)
+                    img_path=img_to_use,
+                    model_name=self.model_name,  # FACE_MODEL o VGG-Face
                     detector_backend=self.backend,  # RetinaFace o MTCNN (robusto)
                     align=self.align_faces,  # True: alineación facial para corregir poses
                     enforce_detection=self.enforce_detection,  # True: requiere rostro válido
@@ -215,17 +337,16 @@ class FaceRecognitionSystem:
                 error_msg = str(e)
                 # Si falló con la imagen preprocesada, intentar nuevamente con la imagen ORIGINAL
                 # y con enforce_detection desactivado para ser más tolerantes
-                if processed_path is not None and (
+                if processed is not None and (
                     "Face could not be detected" in error_msg
                     or "No face detected" in error_msg.lower()
                 ):
                     logger.warning(
                         "No se detectó rostro en imagen preprocesada, reintentando con imagen original",
-                        extra={"image_path": image_path},
                     )
                     try:
                         embedding_obj = DeepFace.represent(
-                            img_path=image_path,
+                            img_path=img,
                             model_name=self.model_name,
                             detector_backend=self.backend,
                             align=self.align_faces,
@@ -233,10 +354,7 @@ class FaceRecognitionSystem:
                             normalization='base',
                         )
                     except Exception as e2:
-                        logger.error(
-                            f"Reintento con imagen original también falló: {e2}",
-                            exc_info=True,
-                        )
+                        logger.opt(exception=True).error(f"Reintento con imagen original también falló: {e2}")
                         raise e  # re-lanzar el error original para manejo homogéneo
                 else:
                     # Cualquier otro ValueError se maneja más abajo
@@ -274,14 +392,8 @@ class FaceRecognitionSystem:
             # Re-lanzar FaceNotFoundError tal cual
             raise
         except Exception as e:
-            logger.error(f"Error inesperado al extraer embedding: {e}", exc_info=True)
+            logger.opt(exception=True).error(f"Error inesperado al extraer embedding: {e}")
             raise FaceNotFoundError(f"Error al procesar la imagen: {str(e)}")
-        finally:
-            if processed_path and os.path.exists(processed_path):
-                try:
-                    os.remove(processed_path)
-                except OSError as cleanup_error:
-                    logger.warning(f"No se pudo eliminar imagen preprocesada temporal: {cleanup_error}")
     
     def calculate_similarity(self, embedding1: np.ndarray, embedding2: np.ndarray) -> float:
         # Calculate cosine similarity between two face embeddings
@@ -289,113 +401,104 @@ class FaceRecognitionSystem:
         Calcula la similitud coseno entre dos embeddings
         
         Args:
-            embedding1: Primer embedding
-            embedding2: Segundo embedding
+            embedding1: Embedding de consulta
+            embedding2: Embedding almacenado (ya normalizado al registrarse, ver Database)
             
         Returns:
             Similitud (0-1, donde 1 es idéntico)
         """
-        # Normalizar embeddings
+        # Solo se normaliza la consulta: los embeddings almacenados ya tienen norma 1
         embedding1_norm = embedding1 / (np.linalg.norm(embedding1) + 1e-10)
-        embedding2_norm = embedding2 / (np.linalg.norm(embedding2) + 1e-10)
         
         # Calcular similitud coseno
-        similarity = np.dot(embedding1_norm, embedding2_norm)
+        similarity = np.dot(embedding1_norm, embedding2)
         
         return float(similarity)
     
     def calculate_similarities_vectorized(
         self, 
         query_embedding: np.ndarray, 
-        all_embeddings: List[Tuple[int, int, np.ndarray, datetime, bool]]
-    ) -> Tuple[np.ndarray, List[str]]:
+        embeddings_matrix: np.ndarray,
+        user_ids: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
         """
         Calcula similitudes con todos los embeddings usando vectorización NumPy
         Esto es MUCHO más rápido que comparar uno por uno en un bucle
         
         Args:
             query_embedding: Embedding de la imagen a comparar
-            all_embeddings: Lista de todos los embeddings almacenados
-                Formato: [(embedding_id, user_id, embedding, created_at, estado), ...]
+            embeddings_matrix: Matriz (N x embedding_dim) de embeddings almacenados,
+                con filas ya normalizadas (ver EmbeddingsCache)
+            user_ids: Array (N,) con el user_id de cada fila de la matriz
         
         Returns:
-            Tuple (array de similitudes, lista de user_ids)
+            Tuple (array de similitudes, array de user_ids)
             - similarities: Array NumPy con similitud para cada embedding
-            - user_ids: Lista de user_ids en el mismo orden
+            - user_ids: Array de user_ids en el mismo orden (sin convertir: el llamador
+              convierte solo los k resultados que devuelve)
         """
-        if not all_embeddings:
-            return np.array([]), []
+        if embeddings_matrix is None or len(embeddings_matrix) == 0:
+            return np.array([]), np.array([])
         
         try:
             # Asegurar que query_embedding es un array NumPy 1D
-            query_embedding = np.asarray(query_embedding, dtype=np.float32).flatten()
-            
-            # Separar embeddings y user_ids en listas
-            embeddings_list = []
-            user_ids_list = []
-            
-            for embedding_id, user_id, embedding, created_at, estado in all_embeddings:
-                # Solo procesar embeddings con estado activo (True)
-                if not estado:
-                    continue
-                # Asegurar que cada embedding es un array NumPy 1D
-                embedding_array = np.asarray(embedding, dtype=np.float32).flatten()
-                
-                # Validar que las dimensiones coincidan
-                if embedding_array.shape[0] != query_embedding.shape[0]:
-                    logger.warning(
-                        f"Embedding del usuario {user_id} tiene dimensión {embedding_array.shape[0]}, "
-                        f"esperado {query_embedding.shape[0]}. Omitiendo."
-                    )
-                    continue
-                
-                embeddings_list.append(embedding_array)
-                user_ids_list.append(str(user_id))
-            
-            if not embeddings_list:
-                logger.error("No hay embeddings válidos para comparar")
-                return np.array([]), []
-            
-            # Crear matriz de embeddings (N x embedding_dim)
-            # Ejemplo: Si hay 100 usuarios con embeddings de 2622 dimensiones = (100, 2622)
-            embeddings_matrix = np.array(embeddings_list, dtype=np.float32)
+            query_embedding = np.asarray(query_embedding, dtype=np.float32).ravel()
             
             # Validar dimensiones
             if embeddings_matrix.ndim != 2:
                 logger.error(f"Matriz de embeddings tiene forma inválida: {embeddings_matrix.shape}")
-                return np.array([]), []
+                return np.array([]), np.array([])
+            
+            if embeddings_matrix.shape[1] != query_embedding.shape[0]:
+                logger.error(
+                    f"Los embeddings almacenados tienen dimensión {embeddings_matrix.shape[1]}, "
+                    f"esperado {query_embedding.shape[0]}"
+                )
+                return np.array([]), np.array([])
             
             # Normalizar query embedding
             query_norm = query_embedding / (np.linalg.norm(query_embedding) + 1e-10)
             
-            # Normalizar TODA la matriz de embeddings a la vez
-            # axis=1 significa normalizar cada fila (cada embedding)
-            # keepdims=True mantiene las dimensiones para broadcasting
-            norms = np.linalg.norm(embeddings_matrix, axis=1, keepdims=True)
-            embeddings_matrix_norm = embeddings_matrix / (norms + 1e-10)
-            
             # Calcular similitudes con TODOS los embeddings simultáneamente
-            # query_norm: (embedding_dim,)
-            # embeddings_matrix_norm: (N, embedding_dim)
-            # Resultado: (N,) - una similitud para cada embedding
-            similarities = np.dot(embeddings_matrix_norm, query_norm)
+            # Las filas de la matriz ya están normalizadas, así que basta con un producto matriz-vector
+            # embeddings_matrix: (N, embedding_dim), query_norm: (embedding_dim,) -> (N,)
+            similarities = embeddings_matrix @ query_norm
             
             # Asegurar que las similitudes están en el rango [-1, 1] (puede haber errores de punto flotante)
-            similarities = np.clip(similarities, -1.0, 1.0)
+            np.clip(similarities, -1.0, 1.0, out=similarities)
             
-            return similarities, user_ids_list
+            return similarities, np.asarray(user_ids)
             
         except Exception as e:
-            logger.error(
-                f"Error al calcular similitudes vectorizadas: {e}",
-                exc_info=True,
-                extra={
-                    "query_embedding_shape": query_embedding.shape if isinstance(query_embedding, np.ndarray) else None,
-                    "num_embeddings": len(all_embeddings)
-                }
-            )
+            logger.opt(exception=True).bind(
+                query_embedding_shape=query_embedding.shape if isinstance(query_embedding, np.ndarray) else None,
+                matrix_shape=embeddings_matrix.shape
+            ).error(f"Error al calcular similitudes vectorizadas: {e}")
             raise
     
+    def top_k_indices(self, similarities: np.ndarray, k: Optional[int] = None) -> np.ndarray:
+        """
+        Índices de las similitudes ordenadas de mayor a menor
+        
+        Con k, usa np.argpartition para seleccionar los k mejores en O(N) y solo ordena esos k,
+        en lugar de ordenar las N similitudes.
+        
+        Args:
+            similarities: Array (N,) de similitudes
+            k: Número de resultados (None = todos)
+            
+        Returns:
+            Array de índices ordenados por similitud descendente (se omiten valores no finitos)
+        """
+        valid = np.flatnonzero(np.isfinite(similarities))
+        values = similarities[valid]
+        
+        if k is not None and 0 < k < len(values):
+            top = np.argpartition(values, -k)[-k:]
+            return valid[top[np.argsort(values[top])[::-1]]]
+        
+        return valid[np.argsort(values)[::-1]]
+    
     def register_face(self, image_bytes: bytes, user_id: str) -> Tuple[bool, str]:
         # Register new face: save image to registered_faces, check database, generate embedding, store in database
         saved_image_path = None
@@ -423,7 +526,12 @@ class FaceRecognitionSystem:
                     f"El usuario {user_id} ya tiene embeddings registrados en la base de datos"
                 )
             
-            embedding = self._extract_face_embedding(str(saved_image_path))
+            # La imagen se guarda en registered_faces, pero el embedding se extrae de los bytes en memoria
+            image = self._decode_image(image_bytes)
+            if image is None:
+                raise InvalidImageError("No se pudo decodificar la imagen")
+            
+            embedding = self._extract_face_embedding(image)
             if embedding is None:
                 if saved_image_path.exists():
                     saved_image_path.unlink()
@@ -436,12 +544,13 @@ class FaceRecognitionSystem:
                     saved_image_path.unlink()
                 raise DatabaseError("Error al insertar embedding en la base de datos")
             
-            # Invalidar caché después de registrar nuevo embedding
-            clear_embeddings_cache()
+            # Agregar la fila al caché en memoria en lugar de invalidarlo y recargar toda la tabla
+            add_embedding_to_cache(embedding_id, user_id_int, embedding)
             
             return True, f"Rostro registrado correctamente para {user_id}"
             
-        except (FaceNotFoundError, DuplicateUserError, DatabaseError, ValidationError, UserNotFoundError) as e:
+        except (FaceNotFoundError, DuplicateUserError, DatabaseError, ValidationError, UserNotFoundError,
+                InvalidImageError) as e:
             # Limpiar archivo si existe antes de re-lanzar excepción
             if saved_image_path and saved_image_path.exists():
                 try:
@@ -449,11 +558,11 @@ class FaceRecognitionSystem:
                 except:
                     pass
             # Re-lanzar excepciones personalizadas para que sean manejadas por el handler global
-            logger.warning(f"Excepción en registro: {e.__class__.__name__} - {e.message}", extra={"user_id": user_id})
+            logger.bind(user_id=user_id).warning(f"Excepción en registro: {e.__class__.__name__} - {e.message}")
             raise
         except Exception as e:
             error_msg = str(e)
-            logger.error(f"Error inesperado al registrar rostro: {error_msg}", exc_info=True)
+            logger.opt(exception=True).error(f"Error inesperado al registrar rostro: {error_msg}")
             # Limpiar archivo si existe
             if saved_image_path and saved_image_path.exists():
                 try:
@@ -139,6 +139,8 @@ def check_cache(embeddings_cache) -> Dict[str, Any]:
                 return {
                     "status": "ok",
                     "embeddings_count": cache_info["embeddings_count"],
+                    "matrix_shape": cache_info.get("matrix_shape"),
+                    "matrix_nbytes": cache_info.get("matrix_nbytes", 0),
                     "cache_size": cache_info["cache_size"],
                     "message": f"Caché activo con {cache_info['embeddings_count']} embeddings"
                 }
@@ -28,7 +28,8 @@ logger.add(
     level=LOG_LEVEL,
     colorize=True,
     backtrace=True,
-    diagnose=True
+    diagnose=True,
+    enqueue=True  # Escritura en un hilo aparte: no bloquea el hilo que atiende la petición
 )
 
 # Configurar handler para archivo (formato JSON estructurado)
@@ -2,6 +2,7 @@
 API FastAPI para el sistema de reconocimiento facial
 """
 import os
+from typing import Optional
 from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request
 from fastapi.responses import JSONResponse
 from pathlib import Path
@@ -62,14 +63,11 @@ async def validate_host_middleware(request: Request, call_next):
     
     # Si no hay Host header, rechazar
     if not host_header:
-        logger.warning(
-            "Request rechazado: Host header faltante",
-            extra={
-                "ip_address": get_remote_address(request),
-                "path": request.url.path,
-                "method": request.method
-            }
-        )
+        logger.bind(
+            ip_address=get_remote_address(request),
+            path=request.url.path,
+            method=request.method
+        ).warning("Request rechazado: Host header faltante")
         return JSONResponse(
             status_code=403,
             content={
@@ -94,16 +92,13 @@ async def validate_host_middleware(request: Request, call_next):
             break
     
     if not is_valid:
-        logger.warning(
-            "Request rechazado: Host no permitido",
-            extra={
-                "ip_address": get_remote_address(request),
-                "host": host_header,
-                "path": request.url.path,
-                "method": request.method,
-                "allowed_hosts": VALID_HOSTS
-            }
-        )
+        logger.bind(
+            ip_address=get_remote_address(request),
+            host=host_header,
+            path=request.url.path,
+            method=request.method,
+            allowed_hosts=VALID_HOSTS
+        ).warning("Request rechazado: Host no permitido")
         return JSONResponse(
             status_code=403,
             content={
@@ -119,14 +114,11 @@ async def validate_host_middleware(request: Request, call_next):
 async def rate_limit_handler(request: Request, exc: RateLimitExceeded):
     client_ip = get_remote_address(request)
     endpoint = request.url.path
-    logger.warning(
-        f"Rate limit excedido",
-        extra={
-            "ip_address": client_ip,
-            "endpoint": endpoint,
-            "limit": str(exc.detail)
-        }
-    )
+    logger.bind(
+        ip_address=client_ip,
+        endpoint=endpoint,
+        limit=str(exc.detail)
+    ).warning(f"Rate limit excedido")
     return _rate_limit_exceeded_handler(request, exc)
 
 app.add_exception_handler(RateLimitExceeded, rate_limit_handler)
@@ -137,15 +129,12 @@ async def face_recognition_exception_handler(request: Request, exc: FaceRecognit
     """
     Handler global para excepciones personalizadas del sistema de reconocimiento facial
     """
-    logger.warning(
-        f"Excepción capturada: {exc.__class__.__name__}",
-        extra={
-            "error_code": exc.error_code,
-            "message": exc.message,
-            "path": request.url.path,
-            "method": request.method
-        }
-    )
+    logger.bind(
+        error_code=exc.error_code,
+        message=exc.message,
+        path=request.url.path,
+        method=request.method
+    ).warning(f"Excepción capturada: {exc.__class__.__name__}")
     
     return JSONResponse(
         status_code=exc.status_code,
@@ -158,15 +147,11 @@ async def global_exception_handler(request: Request, exc: Exception):
     """
     Handler global para errores no manejados
     """
-    logger.error(
-        f"Error no manejado: {exc.__class__.__name__}",
-        extra={
-            "error": str(exc),
-            "path": request.url.path,
-            "method": request.method
-        },
-        exc_info=True
-    )
+    logger.opt(exception=True).bind(
+        error=str(exc),
+        path=request.url.path,
+        method=request.method
+    ).error(f"Error no manejado: {exc.__class__.__name__}")
     
     # En modo desarrollo, incluir más detalles
     import os
@@ -226,14 +211,11 @@ async def register_face(request: Request, file: UploadFile = File(...), user_id:
     Stateless: saves image to registered_faces, checks DB, processes and stores
     """
     try:
-        logger.info(
-            f"Recibida solicitud de registro",
-            extra={
-                "user_id": user_id,
-                "filename": file.filename,
-                "content_type": file.content_type
-            }
-        )
+        logger.bind(
+            user_id=user_id,
+            filename=file.filename,
+            content_type=file.content_type
+        ).info(f"Recibida solicitud de registro")
         
         image_bytes = await file.read()
         
@@ -246,43 +228,31 @@ async def register_face(request: Request, file: UploadFile = File(...), user_id:
             )
             
             # Agregar metadata al log
-            logger.info(
-                f"Archivo validado exitosamente",
-                extra={
-                    "user_id": user_id,
-                    **metadata
-                }
-            )
+            logger.bind(
+                user_id=user_id,
+                **metadata
+            ).info(f"Archivo validado exitosamente")
         except (ValidationError, InvalidImageError) as e:
-            logger.warning(
-                f"Validación de archivo fallida",
-                extra={
-                    "user_id": user_id,
-                    "filename": file.filename,
-                    "error": e.message,
-                    "error_code": e.error_code
-                }
-            )
+            logger.bind(
+                user_id=user_id,
+                filename=file.filename,
+                error=e.message,
+                error_code=e.error_code
+            ).warning(f"Validación de archivo fallida")
             raise  # La excepción será manejada por el handler global
         
         # register_face ahora lanza excepciones directamente en lugar de retornar tuplas
         success, message = face_system.register_face(image_bytes, user_id)
         
         if success:
-            logger.info(
-                f"Usuario registrado exitosamente",
-                extra={"user_id": user_id}
-            )
+            logger.bind(user_id=user_id).info(f"Usuario registrado exitosamente")
             return JSONResponse({
                 "success": True,
                 "message": message
             })
         else:
             # Si todavía retorna False (compatibilidad hacia atrás), crear excepción apropiada
-            logger.warning(
-                f"Error al registrar usuario: {message}",
-                extra={"user_id": user_id}
-            )
+            logger.bind(user_id=user_id).warning(f"Error al registrar usuario: {message}")
             if "ya tiene embeddings" in message.lower() or "ya tiene una imagen" in message.lower():
                 raise DuplicateUserError(user_id, message)
             elif "no se detectó" in message.lower() or "rostro" in message.lower():
@@ -300,11 +270,7 @@ async def register_face(request: Request, file: UploadFile = File(...), user_id:
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(
-            f"Error interno al registrar usuario",
-            extra={"user_id": user_id, "error": str(e)},
-            exc_info=True
-        )
+        logger.opt(exception=True).bind(user_id=user_id, error=str(e)).error(f"Error interno al registrar usuario")
         raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
 
 @app.get("/health")
@@ -363,10 +329,11 @@ async def health_ready(request: Request):
 
 @app.post("/verify-frame")
 @limiter.limit("30/minute")
-async def verify_frame(request: Request, file: UploadFile = File(...)):
+async def verify_frame(request: Request, file: UploadFile = File(...), top_k: Optional[int] = None):
     """
     API endpoint for real-time frame verification
     Stateless: processes frame, compares with DB, returns all similarities
+    (or only the top_k best ones when the query parameter is given)
     """
     try:
         logger.debug("Recibida solicitud de verificación de frame")
@@ -380,129 +347,105 @@ async def verify_frame(request: Request, file: UploadFile = File(...)):
                 content_type=file.content_type
             )
         except (ValidationError, InvalidImageError) as e:
-            logger.warning(
-                f"Validación de archivo fallida en verify-frame",
-                extra={
-                    "filename": file.filename,
-                    "error": e.message,
-                    "error_code": e.error_code
-                }
-            )
+            logger.bind(
+                filename=file.filename,
+                error=e.message,
+                error_code=e.error_code
+            ).warning(f"Validación de archivo fallida en verify-frame")
             raise  # La excepción será manejada por el handler global
         
-        temp_file = None
-        try:
-            from pathlib import Path
-            import uuid
-            temp_dir = Path("temp_images")
-            temp_dir.mkdir(exist_ok=True)
-            unique_id = str(uuid.uuid4())
-            temp_file = temp_dir / f"temp_verify_{unique_id}.jpg"
-            
-            with open(temp_file, 'wb') as f:
-                f.write(image_bytes)
-            
-            embedding = face_system._extract_face_embedding(str(temp_file))
-            
-            if embedding is None:
-                raise FaceNotFoundError("No se detectó rostro en la imagen")
-            
-            # Usar caché con fallback a BD (patrón Cache-Aside)
-            from embeddings_cache import get_all_embeddings_with_cache
-            all_embeddings = get_all_embeddings_with_cache()
-            
-            if not all_embeddings:
-                return JSONResponse({
-                    "success": True,
-                    "best_match": None,
-                    "all_similarities": [],
-                    "other_similarities": [],
-                    "threshold": float(face_system.threshold),
-                    "message": "No hay usuarios registrados"
-                })
-            
+        # Decodificar en memoria y pasar el array a DeepFace (sin archivo temporal)
+        frame = face_system._decode_image(image_bytes)
+        if frame is None:
+            raise InvalidImageError("No se pudo decodificar la imagen")
+        
+        embedding = face_system._extract_face_embedding(frame)
+        
+        if embedding is None:
+            raise FaceNotFoundError("No se detectó rostro en la imagen")
+        
+        # Usar caché con fallback a BD (patrón Cache-Aside)
+        from embeddings_cache import get_all_embeddings_with_cache_async
+        _, embedding_user_ids, embeddings_matrix, _ = await get_all_embeddings_with_cache_async()
+        
+        if len(embedding_user_ids) == 0:
+            return JSONResponse({
+                "success": True,
+                "best_match": None,
+                "all_similarities": [],
+                "other_similarities": [],
+                "threshold": float(face_system.threshold),
+                "message": "No hay usuarios registrados"
+            })
+        
+        if top_k is not None and top_k > 0:
+            # Solo los k mejores: el caché ya está cargado y search() usa el índice HNSW si existe
+            # (o la búsqueda exacta top-k), sin calcular ni ordenar las N similitudes aquí
+            user_ids, similarities_array = embeddings_cache.search(embedding, top_k)
+        else:
             # Usar vectorización NumPy para comparar todos simultáneamente (MUCHO más rápido)
             similarities_array, user_ids = face_system.calculate_similarities_vectorized(
-                embedding, all_embeddings
+                embedding, embeddings_matrix, embedding_user_ids
             )
-            
-            # Validar que tenemos resultados
-            if len(similarities_array) == 0 or len(user_ids) == 0:
-                logger.warning("No se pudieron calcular similitudes - arrays vacíos")
-                return JSONResponse({
-                    "success": True,
-                    "best_match": None,
-                    "all_similarities": [],
-                    "other_similarities": [],
-                    "threshold": float(face_system.threshold),
-                    "message": "No se pudieron calcular similitudes"
-                })
-            
-            # Validar que los arrays tienen la misma longitud
-            if len(similarities_array) != len(user_ids):
-                logger.error(
-                    f"Longitud inconsistente: similarities={len(similarities_array)}, user_ids={len(user_ids)}"
-                )
-                return JSONResponse({
-                    "success": False,
-                    "error": "Error al calcular similitudes: arrays inconsistentes"
-                }, status_code=500)
-            
-            # Crear lista de resultados directamente desde arrays
-            similarities = []
-            for uid, sim in zip(user_ids, similarities_array):
-                try:
-                    similarity_float = float(sim)
-                    # Validar que la similitud está en rango válido [-1, 1]
-                    if not (-1.0 <= similarity_float <= 1.0):
-                        logger.warning(f"Similitud fuera de rango para usuario {uid}: {similarity_float}")
-                        similarity_float = max(-1.0, min(1.0, similarity_float))  # Clamp
-                    similarities.append({"user_id": uid, "similarity": similarity_float})
-                except (ValueError, TypeError) as e:
-                    logger.warning(f"Error al convertir similitud para usuario {uid}: {e}, valor: {sim}")
-                    continue
-            
-            if not similarities:
-                logger.warning("No se pudieron crear similitudes válidas")
-                return JSONResponse({
-                    "success": True,
-                    "best_match": None,
-                    "all_similarities": [],
-                    "other_similarities": [],
-                    "threshold": float(face_system.threshold),
-                    "message": "No se pudieron crear similitudes válidas"
-                })
-            
-            # Ordenar por similitud descendente
-            similarities.sort(key=lambda x: x["similarity"], reverse=True)
-            
-            best_match = similarities[0] if similarities else None
-            other_similarities = similarities[1:] if len(similarities) > 1 else []
-            
+        
+        # Validar que tenemos resultados
+        if len(similarities_array) == 0 or len(user_ids) == 0:
+            logger.warning("No se pudieron calcular similitudes - arrays vacíos")
             return JSONResponse({
                 "success": True,
-                "best_match": best_match,
-                "all_similarities": similarities,
-                "other_similarities": other_similarities,
-                "threshold": float(face_system.threshold)
+                "best_match": None,
+                "all_similarities": [],
+                "other_similarities": [],
+                "threshold": float(face_system.threshold),
+                "message": "No se pudieron calcular similitudes"
             })
-            
-        finally:
-            if temp_file and temp_file.exists():
-                try:
-                    os.remove(temp_file)
-                except:
-                    pass
-                    
+        
+        # Validar que los arrays tienen la misma longitud
+        if len(similarities_array) != len(user_ids):
+            logger.error(f"Longitud inconsistente: similarities={len(similarities_array)}, user_ids={len(user_ids)}")
+            return JSONResponse({
+                "success": False,
+                "error": "Error al calcular similitudes: arrays inconsistentes"
+            }, status_code=500)
+        
+        # Ordenar por similitud descendente (con top_k solo se seleccionan y ordenan los k mejores)
+        order = face_system.top_k_indices(similarities_array, top_k)
+        # Conversión a tipos de Python en bloque (tolist) y solo para los resultados devueltos
+        similarities = [
+            {"user_id": str(user_id), "similarity": similarity}
+            for user_id, similarity in zip(user_ids[order].tolist(), similarities_array[order].tolist())
+        ]
+        
+        if not similarities:
+            logger.warning("No se pudieron crear similitudes válidas")
+            return JSONResponse({
+                "success": True,
+                "best_match": None,
+                "all_similarities": [],
+                "other_similarities": [],
+                "threshold": float(face_system.threshold),
+                "message": "No se pudieron crear similitudes válidas"
+            })
+        
+        best_match = similarities[0] if similarities else None
+        other_similarities = similarities[1:] if len(similarities) > 1 else []
+        
+        return JSONResponse({
+            "success": True,
+            "best_match": best_match,
+            "all_similarities": similarities,
+            "other_similarities": other_similarities,
+            "threshold": float(face_system.threshold)
+        })
+        
     except FaceNotFoundError as e:
         logger.warning(f"Rostro no detectado en verify-frame: {e}")
         raise  # Será manejado por el handler global
+    except FaceRecognitionException:
+        # Las excepciones personalizadas serán manejadas por el handler global
+        raise
     except Exception as e:
-        logger.error(
-            "Error interno en verify-frame",
-            extra={"error": str(e), "error_type": type(e).__name__},
-            exc_info=True
-        )
+        logger.opt(exception=True).bind(error=str(e), error_type=type(e).__name__).error("Error interno en verify-frame")
         raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
 
 def start_server():
@@ -511,30 +454,12 @@ def start_server():
         uvicorn.run(app, host="0.0.0.0", port=int(API_PORT), log_level="info")
     except OSError as e:
         if e.errno == 10048 or "Address already in use" in str(e) or "solo se permite un uso" in str(e):
-            logger.error(
-                f"❌ ERROR: El puerto {API_PORT} ya está en uso por otro proceso",
-                exc_info=False
-            )
-            logger.error(
-                f"💡 Soluciones:",
-                exc_info=False
-            )
-            logger.error(
-                f"   1. Cierra el proceso que está usando el puerto {API_PORT}",
-                exc_info=False
-            )
-            logger.error(
-                f"   2. O cambia el puerto en tu archivo .env (API_PORT=8002)",
-                exc_info=False
-            )
-            logger.error(
-                f"   3. Para encontrar el proceso: netstat -ano | findstr :{API_PORT}",
-                exc_info=False
-            )
-            logger.error(
-                f"   4. Para matar el proceso: taskkill /PID <PID> /F",
-                exc_info=False
-            )
+            logger.error(f"❌ ERROR: El puerto {API_PORT} ya está en uso por otro proceso")
+            logger.error(f"💡 Soluciones:")
+            logger.error(f"   1. Cierra el proceso que está usando el puerto {API_PORT}")
+            logger.error(f"   2. O cambia el puerto en tu archivo .env (API_PORT=8002)")
+            logger.error(f"   3. Para encontrar el proceso: netstat -ano | findstr :{API_PORT}")
+            logger.error(f"   4. Para matar el proceso: taskkill /PID <PID> /F")
         raise
 
 def start_gui():
@@ -554,7 +479,7 @@ def start_gui():
         root.protocol("WM_DELETE_WINDOW", on_closing)
         root.mainloop()
     except Exception as e:
-        logger.error(f"No se pudo iniciar la GUI: {e}", exc_info=True)
+        logger.opt(exception=True).error(f"No se pudo iniciar la GUI: {e}")
         logger.info(f"El servidor API sigue ejecutándose en http://{API_HOST}:{API_PORT}")
 
 if __name__ == "__main__":
@@ -0,0 +1,16 @@
+-- Índice sobre la columna FK de usuarios_face_embeddings
+--
+-- Cubre las consultas de Database que filtran o agrupan por usuario:
+--   get_embeddings_by_user  -> WHERE id_usuario = %s
+--   user_has_embeddings     -> EXISTS(... WHERE id_usuario = %s LIMIT 1)
+--   get_all_user_ids        -> SELECT DISTINCT id_usuario (loose index scan, sin leer los BLOBs)
+--
+-- Si el esquema usa otra columna FK (USERS_FK_COLUMN), reemplazar id_usuario.
+-- MySQL crea un índice implícito para la FOREIGN KEY solo si no existe uno utilizable;
+-- con este índice explícito ese índice implícito deja de ser necesario.
+
+CREATE INDEX idx_ufe_user ON usuarios_face_embeddings (id_usuario);
+
+-- Opcional: si alguna vez se necesita ordenar los embeddings de un usuario por fecha,
+-- un índice compuesto sirve para ambas cosas y reemplaza al anterior:
+-- CREATE INDEX idx_ufe_user_creado ON usuarios_face_embeddings (id_usuario, creado_en);
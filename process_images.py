@@ -1,10 +1,40 @@
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import cv2
 from deepface import DeepFace
 import numpy as np
 from database import Database
 
+def _select_backend_and_model():
+    # Elegir detector y modelo una sola vez (misma configuración que face_recognition_system)
+    # Intentar RetinaFace primero, luego MTCNN, luego opencv como fallback
+    try:
+        import retinaface
+        backend = 'retinaface'  # DeepFace espera minúsculas
+        print(f"[INFO] Usando detector: RetinaFace")
+    except:
+        try:
+            DeepFace.build_model('MTCNN')
+            backend = 'mtcnn'
+            print(f"[INFO] Usando detector: MTCNN")
+        except:
+            backend = 'opencv'
+            print(f"[INFO] Usando detector: opencv (fallback)")
+    
+    try:
+        # Mismo modelo que la API (FACE_MODEL); si no coinciden, los embeddings no son comparables
+        # DeepFace guarda el modelo construido y lo reutiliza en cada represent()
+        model = os.getenv('FACE_MODEL', 'ArcFace')
+        DeepFace.build_model(model)
+        print(f"[INFO] Usando modelo: {model}")
+    except:
+        model = 'VGG-Face'
+        print(f"[INFO] Usando modelo: VGG-Face")
+    
+    return backend, model
+
 def process_images_in_folder(folder_path="registered_faces"):
     # Check images against database and generate embeddings for new users
     faces_dir = Path(folder_path)
@@ -32,15 +62,18 @@ def process_images_in_folder(folder_path="registered_faces"):
     print(f"[INFO] Usuarios con embeddings en BD: {len(existing_user_ids)}")
     print()
     
-    image_extensions = ['.jpg', '.jpeg', '.png', '.bmp']
+    image_extensions = ('.jpg', '.jpeg', '.png', '.bmp')
     
     processed_count = 0
     skipped_count = 0
     error_count = 0
     
-    all_images = []
-    for ext in image_extensions:
-        all_images.extend(list(faces_dir.glob(f"*{ext}")))
+    # Un solo recorrido del directorio (antes un glob por extensión); DirEntry.is_file no hace stat extra
+    with os.scandir(faces_dir) as entries:
+        all_images = [
+            Path(entry.path) for entry in entries
+            if entry.is_file() and entry.name.lower().endswith(image_extensions)
+        ]
     
     if not all_images:
         print("[INFO] No se encontraron imágenes en la carpeta.")
@@ -48,8 +81,13 @@ def process_images_in_folder(folder_path="registered_faces"):
         return
     
     print(f"[INFO] Se encontraron {len(all_images)} imagen(es).")
+    
+    # Detector y modelo se eligen una sola vez para todo el lote (no por imagen)
+    backend, model = _select_backend_and_model()
     print()
     
+    # Primera pasada: validar nombres y descartar usuarios ya registrados (sin leer imágenes)
+    pending = []
     for image_file in all_images:
         try:
             user_id = int(image_file.stem)
@@ -63,37 +101,29 @@ def process_images_in_folder(folder_path="registered_faces"):
             skipped_count += 1
             continue
         
+        pending.append((image_file, user_id))
+    
+    # Segunda pasada: la siguiente imagen se lee y decodifica en otro hilo mientras DeepFace procesa la actual
+    # (cv2.imread libera el GIL; solo se adelanta una imagen para no cargar toda la carpeta en memoria)
+    reader = ThreadPoolExecutor(max_workers=1)
+    next_image = reader.submit(cv2.imread, str(pending[0][0])) if pending else None
+    
+    for position, (image_file, user_id) in enumerate(pending):
         print(f"[PROC] Procesando: {image_file.name} (user_id: {user_id})...")
         
+        img = next_image.result()
+        if position + 1 < len(pending):
+            next_image = reader.submit(cv2.imread, str(pending[position + 1][0]))
+        
+        if img is None:
+            print(f"[ERROR] No se pudo leer la imagen: {image_file.name}")
+            error_count += 1
+            print()
+            continue
+        
         try:
-            # Usar configuración optimizada (misma que face_recognition_system)
-            # Intentar RetinaFace primero, luego MTCNN, luego opencv como fallback
-            backend = 'opencv'  # Por defecto
-            model = 'VGG-Face'  # Por defecto
-            
-            try:
-                import retinaface
-                backend = 'retinaface'  # DeepFace espera minúsculas
-                print(f"  [INFO] Usando detector: RetinaFace")
-            except:
-                try:
-                    DeepFace.build_model('MTCNN')
-                    backend = 'mtcnn'
-                    print(f"  [INFO] Usando detector: MTCNN")
-                except:
-                    backend = 'opencv'
-                    print(f"  [INFO] Usando detector: opencv (fallback)")
-            
-            try:
-                DeepFace.build_model('ArcFace')
-                model = 'ArcFace'
-                print(f"  [INFO] Usando modelo: ArcFace")
-            except:
-                model = 'VGG-Face'
-                print(f"  [INFO] Usando modelo: VGG-Face")
-            
             embedding_obj = DeepFace.represent(
-                img_path=str(image_file),
+                img_path=img,
                 model_name=model,
                 detector_backend=backend,
                 align=True,  # Alineación facial para corregir poses
@@ -106,9 +136,11 @@ def process_images_in_folder(folder_path="registered_faces"):
                 error_count += 1
                 continue
             
-            # Extraer y normalizar embedding (mismo proceso que en face_recognition_system)
-            embedding = np.array(embedding_obj[0]['embedding'])
-            # Normalizar para similitud coseno consistente
+            # Extraer y normalizar embedding (mismo proceso que en face_recognition_system:
+            # centrar y norma L2, en float32). Se guarda ya normalizado, así la similitud coseno
+            # en la API es un simple producto punto con la consulta
+            embedding = np.asarray(embedding_obj[0]['embedding'], dtype=np.float32)
+            embedding -= embedding.mean()
             embedding_norm = embedding / (np.linalg.norm(embedding) + 1e-10)
             
             embedding_id = Database.insert_embedding(user_id, embedding_norm)
@@ -126,6 +158,8 @@ def process_images_in_folder(folder_path="registered_faces"):
             error_count += 1
             print()
     
+    reader.shutdown()
+    
     # Resumen
     print("\n" + "="*60)
     print("Resumen del procesamiento")
@@ -152,11 +186,17 @@ def main():
     print("="*60)
     print("\nEste script procesa imágenes JPG/PNG en la carpeta 'registered_faces/'")
     print("y genera los embeddings necesarios para el reconocimiento facial.")
-    print("Las imágenes deben nombrarse con su user_id (ej: 1.png, 2.jpg, etc.)\n")
+    print("Las imágenes deben nombrarse con su user_id (ej: 1.png, 2.jpg, etc.)")
+    print("Usa --normalize para normalizar los embeddings ya guardados en la base de datos.\n")
     
     folder_path = sys.argv[1] if len(sys.argv) > 1 else "registered_faces"
     
     try:
+        if folder_path == "--normalize":
+            # Migración única: reescribir embeddings existentes con norma unitaria
+            updated = Database.migrate_normalize()
+            print(f"[OK] Embeddings normalizados: {updated}")
+            return
         process_images_in_folder(folder_path)
     except KeyboardInterrupt:
         print("\n\n[INFO] Procesamiento cancelado por el usuario.")